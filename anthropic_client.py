@@ -0,0 +1,317 @@
+"""Shared HTTP client for the Anthropic Messages API used by the AI features.
+
+One pooled requests.Session is kept per process so repeated AI clicks reuse
+warm keep-alive connections instead of paying a fresh TCP+TLS handshake.
+Set ANTHROPIC_BASE_URL to point the app at a local stand-in such as
+mock_anthropic_server.py.
+
+Successful replies are cached on disk, keyed on model, max_tokens and a hash
+of the prompt, so asking the same thing twice is instant and works offline.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+API_BASE_URL = os.environ.get('ANTHROPIC_BASE_URL', 'https://api.anthropic.com').rstrip('/')
+API_VERSION = '2023-06-01'
+DEFAULT_MODEL = 'claude-sonnet-4-20250514'
+
+# Connections kept open per host; enough for a handful of concurrent AI requests
+POOL_SIZE = 10
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+# 429 (rate limited) and 529 (overloaded) are retried with exponential backoff,
+# waiting as long as the server's retry-after asks unless that exceeds
+# BACKOFF_MAX_SECONDS, in which case the response is returned straight away
+RETRY_STATUSES = (429, 529)
+MAX_RETRIES = 3
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 20.0
+
+# One JSON file per cached reply; least recently used files are evicted once
+# the directory passes CACHE_MAX_BYTES, and entries expire after CACHE_TTL_SECONDS
+CACHE_DIR = os.environ.get('ANTHROPIC_CACHE_DIR', 'ai_response_cache')
+CACHE_MAX_BYTES = 5 * 1024 * 1024
+CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the process-wide pooled session, creating it on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+    return _session
+
+
+class APIError(Exception):
+    """Non-200 reply from the Messages API; str() is the user-facing message"""
+
+    def __init__(self, response):
+        super().__init__(error_message(response))
+        self.status_code = response.status_code
+
+
+class RateLimiter:
+    """Spaces requests evenly so concurrent workers stay under a per-minute budget"""
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until this caller's slot comes round"""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+
+def cache_key(model, max_tokens, prompt):
+    """Content address for a request: anything that changes the reply changes the key"""
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return hashlib.sha256(f"{model}\n{max_tokens}\n{prompt_hash}".encode('utf-8')).hexdigest()
+
+
+def cache_get(key):
+    """Return the cached reply for key, or None if missing or expired"""
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    if time.time() - entry['created'] > CACHE_TTL_SECONDS:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    # mtime doubles as the last-used time for LRU eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return entry['text']
+
+
+def cache_put(key, text):
+    """Store a reply, then evict least recently used entries past CACHE_MAX_BYTES"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'created': time.time(), 'text': text}, f)
+    os.replace(tmp_path, path)
+    evict_cache()
+
+
+def evict_cache():
+    """Delete least recently used cache files until the cache fits CACHE_MAX_BYTES"""
+    entries = []
+    total = 0
+    with os.scandir(CACHE_DIR) as it:
+        for entry in it:
+            if entry.name.endswith('.json'):
+                # Another thread's eviction may delete the file between scan and stat
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+    for _, size, path in sorted(entries):
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with jitter for the given retry attempt"""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def retry_after_seconds(response):
+    """Seconds the server asked us to wait, or None if it did not say"""
+    try:
+        return float(response.headers.get('retry-after', ''))
+    except ValueError:
+        return None
+
+
+def connection_not_established(error):
+    """True if a request failed before any connection was made, so nothing was sent"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    # Refused connections and DNS failures arrive wrapped in urllib3's MaxRetryError
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def post_messages(api_key, payload, read_timeout=READ_TIMEOUT, stream=False):
+    """POST to /v1/messages, retrying rate limits, overloads and failed connects"""
+    headers = {
+        "x-api-key": api_key,
+        "anthropic-version": API_VERSION,
+        "content-type": "application/json"
+    }
+
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = get_session().post(
+                f"{API_BASE_URL}/v1/messages",
+                headers=headers,
+                json=payload,
+                timeout=(CONNECT_TIMEOUT, read_timeout),
+                stream=stream
+            )
+        except requests.exceptions.ConnectionError as e:
+            # Only retry when nothing reached the server; a connection dropped after
+            # the request was sent may still have been billed
+            if attempt == MAX_RETRIES or not connection_not_established(e):
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            return response
+
+        delay = retry_after_seconds(response)
+        if delay is None:
+            delay = backoff_delay(attempt)
+        elif delay > BACKOFF_MAX_SECONDS:
+            return response
+        response.close()
+        time.sleep(delay)
+
+
+def error_message(response):
+    """User-facing message for a non-200 API response"""
+    if response.status_code == 401:
+        return "❌ Invalid API key. Please check your key and try again."
+    elif response.status_code == 429:
+        return "⚠️ Rate limit reached. Please wait a moment and try again."
+    else:
+        return f"❌ Error {response.status_code}: {response.text}"
+
+
+def fetch_reply(api_key, prompt, max_tokens=1000, model=DEFAULT_MODEL, use_cache=True, regenerate=False,
+                limiter=None, read_timeout=READ_TIMEOUT):
+    """Send a single-turn prompt and return the reply text, raising on failure.
+
+    With use_cache, a cached reply is returned without calling the API unless
+    regenerate is set; fresh successful replies are cached either way. A
+    limiter, if given, is only waited on when the API is actually called.
+    """
+    key = cache_key(model, max_tokens, prompt)
+    if use_cache and not regenerate:
+        cached = cache_get(key)
+        if cached is not None:
+            return cached
+
+    if limiter is not None:
+        limiter.wait()
+    response = post_messages(api_key, {
+        "model": model,
+        "max_tokens": max_tokens,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ]
+    }, read_timeout=read_timeout)
+    if response.status_code != 200:
+        raise APIError(response)
+
+    text = response.json()['content'][0]['text']
+    if use_cache:
+        # The reply is already paid for; failing to cache it must not lose it
+        try:
+            cache_put(key, text)
+        except OSError:
+            pass
+    return text
+
+
+def stream_complete(api_key, prompt, max_tokens=1000, model=DEFAULT_MODEL, use_cache=True, regenerate=False):
+    """Send a single-turn prompt and yield reply text as the server-sent events arrive.
+
+    Errors are yielded as user-facing messages rather than raised, so callers
+    can render the stream without special cases. Caching works as in
+    fetch_reply(); a cached reply is yielded as a single chunk.
+    """
+    key = cache_key(model, max_tokens, prompt)
+    if use_cache and not regenerate:
+        cached = cache_get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    finished = False
+    try:
+        response = post_messages(api_key, {
+            "model": model,
+            "max_tokens": max_tokens,
+            "stream": True,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ]
+        }, stream=True)
+
+        if response.status_code != 200:
+            yield error_message(response)
+            return
+
+        with response:
+            for line in response.iter_lines():
+                # Only data lines matter; event names are repeated inside the JSON
+                if not line.startswith(b'data:'):
+                    continue
+                event = json.loads(line[5:].decode('utf-8'))
+                if event['type'] == 'content_block_delta' and event['delta'].get('type') == 'text_delta':
+                    parts.append(event['delta']['text'])
+                    yield event['delta']['text']
+                elif event['type'] == 'error':
+                    yield f"❌ Error: {event['error'].get('message', 'stream interrupted')}"
+                    return
+                elif event['type'] == 'message_stop':
+                    finished = True
+                    break
+    except requests.exceptions.Timeout:
+        yield "⚠️ Request timed out. Please check your internet connection and try again."
+        return
+    except Exception as e:
+        yield f"❌ Error: {str(e)}"
+        return
+
+    # A stream cut off before message_stop is never cached
+    if use_cache and finished:
+        try:
+            cache_put(key, ''.join(parts))
+        except OSError:
+            pass
@@ -0,0 +1,119 @@
+"""Measure AI-feature throughput and tail latency against the local mock API.
+
+Starts mock_anthropic_server in-process (or targets --base-url) and sends
+requests through anthropic_client exactly as the app does:
+
+    python benchmark_ai.py --requests 200 --concurrency 8 --latency 0.2 --jitter 0.1
+
+For each scenario it reports requests per second and p50/p95/p99 latency:
+plain replies, streamed replies (time to first text and to the end), and
+replies served from the on-disk response cache.
+"""
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import anthropic_client
+from mock_anthropic_server import MockServer
+
+API_KEY = "benchmark-key"
+
+
+def percentiles(samples):
+    """p50, p95 and p99 of a list of seconds, in milliseconds"""
+    if len(samples) == 1:
+        return [samples[0] * 1000] * 3
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return [cuts[49] * 1000, cuts[94] * 1000, cuts[98] * 1000]
+
+
+def report(name, samples, errors, elapsed):
+    """Print one result line"""
+    if not samples:
+        print(f"{name:<14} no successful requests, {errors} errors")
+        return
+    p50, p95, p99 = percentiles(samples)
+    rate = len(samples) / elapsed
+    print(f"{name:<14} {len(samples):>5} ok {errors:>4} err {rate:>8.1f} req/s"
+          f"   p50 {p50:>8.1f} ms   p95 {p95:>8.1f} ms   p99 {p99:>8.1f} ms")
+
+
+def run_plain(index, use_cache):
+    """One non-streaming request; returns its latency in seconds"""
+    prompt = "benchmark cached prompt" if use_cache else f"benchmark prompt {index}"
+    start = time.perf_counter()
+    anthropic_client.fetch_reply(API_KEY, prompt, max_tokens=200, use_cache=use_cache)
+    return time.perf_counter() - start
+
+
+def run_stream(index):
+    """One streamed request; returns (time to first text, total time) in seconds"""
+    start = time.perf_counter()
+    first = None
+    for chunk in anthropic_client.stream_complete(API_KEY, f"benchmark prompt {index}", max_tokens=200, use_cache=False):
+        if first is None:
+            # stream_complete reports failures as text rather than raising
+            if chunk.startswith(('❌', '⚠️')):
+                raise RuntimeError(chunk)
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def run_scenario(name, job, count, concurrency):
+    """Run job(i) count times on a thread pool and report the latencies it returns"""
+    samples = []
+    errors = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(job, i) for i in range(count)]
+        for future in futures:
+            try:
+                samples.append(future.result())
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - start
+
+    if samples and isinstance(samples[0], tuple):
+        report(f"{name} (first)", [s[0] for s in samples], errors, elapsed)
+        report(f"{name} (total)", [s[1] for s in samples], errors, elapsed)
+    else:
+        report(name, samples, errors, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--base-url", help="benchmark an already running server instead of an in-process mock")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock: seconds before each reply starts")
+    parser.add_argument("--jitter", type=float, default=0.02, help="mock: random +/- seconds added to --latency")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="mock: seconds between streamed words")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="mock: requests per second before 429s")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="mock: fraction of requests answered with 529")
+    args = parser.parse_args()
+
+    if args.base_url:
+        anthropic_client.API_BASE_URL = args.base_url.rstrip('/')
+    else:
+        server = MockServer(("127.0.0.1", 0), latency=args.latency, jitter=args.jitter,
+                            token_delay=args.token_delay, rate_limit=args.rate_limit,
+                            overload_rate=args.overload_rate)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        anthropic_client.API_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(f"Target {anthropic_client.API_BASE_URL}, {args.requests} requests per scenario, "
+          f"concurrency {args.concurrency}")
+    # Keep the benchmark's cache entries out of the app's cache, and clean them up afterwards
+    with tempfile.TemporaryDirectory(prefix="ai_benchmark_cache_") as cache_dir:
+        anthropic_client.CACHE_DIR = cache_dir
+        run_scenario("plain", lambda i: run_plain(i, use_cache=False), args.requests, args.concurrency)
+        run_scenario("stream", run_stream, args.requests, args.concurrency)
+        run_plain(0, use_cache=True)
+        run_scenario("cached", lambda i: run_plain(i, use_cache=True), args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
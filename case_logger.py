@@ -1,10 +1,27 @@
 import streamlit as st
 import pandas as pd
 import json
-from datetime import datetime, date, time as dt_time
+import atexit
+import bisect
+import csv
+import heapq
+import html
+import io
+import logging
+from itertools import islice
+from collections import OrderedDict
+from datetime import datetime, date, timedelta, time as dt_time
 import os
-import requests
 import random
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+from tempfile import SpooledTemporaryFile
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import anthropic_client
 
 def check_smart_reminders():
     """Check if it's reminder time (5pm-5:30pm) and show reminder"""
@@ -20,12 +37,13 @@ def check_smart_reminders():
             st.session_state[reminder_key] = True
             
             # Count incomplete cases
-            incomplete = [c for c in st.session_state.cases if not c.get('completed', False)]
+            stats = st.session_state.case_stats
+            incomplete = stats['total'] - stats['complete']
             
             if incomplete:
                 st.warning(f"""
                 ### ⏰ End of Day Reminder
-                You have **{len(incomplete)} incomplete case(s)** to finish!
+                You have **{incomplete} incomplete case(s)** to finish!
                 
                 **Why complete them now?**
                 - Details are fresh in your mind
@@ -35,6 +53,224 @@ def check_smart_reminders():
                 👉 Scroll down to complete them before you leave!
                 """)
 
+def summarize_case_for_mcq(case):
+    """One-line summary of every clinical detail in a case, for the MCQ prompt"""
+    summary_parts = []
+    
+    # Assessment type
+    assessment_type = case.get('assessment_type', 'case')
+    if assessment_type != 'case':
+        summary_parts.append(f"Assessment: {ASSESSMENT_TYPES.get(assessment_type, assessment_type)}")
+    
+    # Core details
+    if case.get('procedure'):
+        summary_parts.append(f"Procedure: {case['procedure']}")
+    if case.get('operation_type'):
+        summary_parts.append(f"Specialty: {case['operation_type']}")
+    if case.get('anaesthetic_type'):
+        summary_parts.append(f"Anaesthetic: {case['anaesthetic_type']}")
+    if case.get('urgency'):
+        summary_parts.append(f"Urgency: {case['urgency']}")
+    if case.get('age_category'):
+        summary_parts.append(f"Patient: {case['age_category']}")
+    if case.get('asa_grade'):
+        summary_parts.append(f"ASA: {case['asa_grade']}")
+    if case.get('supervision_level'):
+        summary_parts.append(f"Role: {case['supervision_level']}")
+    
+    # Clinical content
+    if case.get('notes'):
+        summary_parts.append(f"Notes: {case['notes'][:300]}")
+    if case.get('reflection'):
+        summary_parts.append(f"Reflection: {case['reflection'][:200]}")
+    if case.get('learning'):
+        summary_parts.append(f"Learning: {case['learning'][:200]}")
+    
+    # CBD/CEX scores
+    if case.get('cbd_scores'):
+        scores_text = ', '.join([f"{k}: {v}" for k, v in case['cbd_scores'].items() if v])
+        if scores_text:
+            summary_parts.append(f"CBD scores: {scores_text}")
+    if case.get('cex_scores'):
+        scores_text = ', '.join([f"{k}: {v}" for k, v in case['cex_scores'].items() if v])
+        if scores_text:
+            summary_parts.append(f"CEX scores: {scores_text}")
+    
+    return ' | '.join(summary_parts)
+
+def build_mcq_prompt(cases_summary, num_questions, first_number):
+    """Prompt for one chunk of MCQs, numbered so chunks join up in order"""
+    return f"""Based on these anaesthetic cases from my clinical practice, generate {num_questions} Primary FRCA-style MCQ questions (SBA format - one best answer from 5 options).
+
+My Cases:
+{chr(10).join([f"{i+1}. {s}" for i, s in enumerate(cases_summary)])}
+
+For each question:
+1. Create a realistic clinical scenario based on the cases above
+2. Ask a question relevant to Primary FRCA (pharmacology, physiology, physics, clinical anaesthesia)
+3. Provide 5 options (A-E) with ONE best answer
+4. Include a brief explanation of the correct answer
+
+Number the questions starting from QUESTION {first_number}.
+
+Format each question as:
+QUESTION X:
+[Clinical scenario and question]
+A) [option]
+B) [option]
+C) [option]
+D) [option]
+E) [option]
+
+ANSWER: [Letter]
+EXPLANATION: [Brief explanation]
+
+---"""
+
+def build_mcq_chunks(sampled_cases, num_questions):
+    """Split an MCQ request into small independent chunks, spreading the questions evenly"""
+    groups = [sampled_cases[i:i + MCQ_CASES_PER_CHUNK] for i in range(0, len(sampled_cases), MCQ_CASES_PER_CHUNK)]
+    chunks = []
+    first_number = 1
+    for i, group in enumerate(groups):
+        questions = num_questions // len(groups) + (1 if i < num_questions % len(groups) else 0)
+        chunks.append({
+            'case_ids': [case['id'] for case in group],
+            'questions': questions,
+            'first_number': first_number,
+            'prompt': build_mcq_prompt([summarize_case_for_mcq(case) for case in group], questions, first_number),
+            'records': [],
+            'error': None
+        })
+        first_number += questions
+    return chunks
+
+def mcq_chunk_label(chunk):
+    """Human label for the questions a chunk covers"""
+    last_number = chunk['first_number'] + chunk['questions'] - 1
+    if last_number == chunk['first_number']:
+        return f"question {last_number}"
+    return f"questions {chunk['first_number']}-{last_number}"
+
+def parse_mcqs(text, case_ids):
+    """Parse SBA questions in the prompt's format into records; malformed ones are dropped"""
+    records = []
+    for block in MCQ_QUESTION_RE.split(text)[1:]:
+        stem, options, answer, explanation = [], {}, None, []
+        section = 'stem'
+        for line in block.splitlines():
+            if line.strip() == '---':
+                break
+            option = MCQ_OPTION_RE.match(line)
+            if option and section in ('stem', 'options'):
+                options[option.group(1)] = option.group(2).strip()
+                section = 'options'
+                continue
+            answer_match = MCQ_ANSWER_RE.match(line)
+            if answer_match:
+                answer = answer_match.group(1).upper()
+                section = 'answer'
+                continue
+            explanation_match = MCQ_EXPLANATION_RE.match(line)
+            if explanation_match:
+                explanation.append(explanation_match.group(1))
+                section = 'explanation'
+                continue
+            if section == 'stem':
+                stem.append(line)
+            elif section == 'explanation':
+                explanation.append(line)
+        
+        stem_text = '\n'.join(stem).strip()
+        if stem_text and sorted(options) == list('ABCDE') and answer in options:
+            records.append({
+                'stem': stem_text,
+                'options': options,
+                'answer': answer,
+                'explanation': '\n'.join(explanation).strip(),
+                'case_ids': list(case_ids),
+                'created': datetime.now().isoformat(timespec='seconds')
+            })
+    return records
+
+def format_mcq(question, number):
+    """Plain-text rendering of a bank question, in the same layout the prompt asks for"""
+    lines = [f"QUESTION {number}:", question['stem']]
+    lines += [f"{letter}) {question['options'][letter]}" for letter in 'ABCDE']
+    lines += ['', f"ANSWER: {question['answer']}", f"EXPLANATION: {question['explanation']}"]
+    return '\n'.join(lines)
+
+def show_mcq(placeholder, question, number):
+    """Render one question with a line break per line"""
+    placeholder.markdown(format_mcq(question, number).replace('\n', '  \n'))
+
+def render_mcq_chunk(placeholder, chunk):
+    """Show a finished chunk's questions, or why it failed"""
+    if chunk['error'] is None:
+        placeholder.markdown('\n\n'.join(format_mcq(question, chunk['first_number'] + offset).replace('\n', '  \n')
+                                          for offset, question in enumerate(chunk['records'])))
+    else:
+        placeholder.error(f"Could not generate {mcq_chunk_label(chunk)}: {chunk['error']}")
+
+def run_mcq_chunks(api_key, chunks, indexes, placeholders):
+    """Request the given chunks concurrently, rendering each one as it completes"""
+    pool = ThreadPoolExecutor(max_workers=MCQ_WORKERS)
+    try:
+        # Fresh questions on every click, so these replies skip the response cache
+        futures = {
+            pool.submit(anthropic_client.fetch_reply, api_key, chunks[i]['prompt'],
+                        max_tokens=MCQ_TOKENS_PER_QUESTION * chunks[i]['questions'],
+                        use_cache=False, read_timeout=MCQ_READ_TIMEOUT): i
+            for i in indexes
+        }
+        for future in as_completed(futures):
+            chunk = chunks[futures[future]]
+            try:
+                chunk['records'] = parse_mcqs(future.result(), chunk['case_ids'])
+                chunk['error'] = None if chunk['records'] else "the reply was not in MCQ format"
+            except anthropic_client.APIError as e:
+                chunk['error'] = str(e)
+            except Exception as e:
+                chunk['error'] = f"❌ Error: {str(e)}"
+            render_mcq_chunk(placeholders[futures[future]], chunk)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def add_mcqs_to_bank(api_key, cases):
+    """Generate one question per case, showing each as it arrives, and save them to the bank
+    
+    A case whose request fails stays uncovered, so the next run retries just that case.
+    """
+    chunks = build_mcq_chunks(cases, len(cases))
+    placeholders = []
+    for chunk in chunks:
+        placeholders.append(st.empty())
+        placeholders[-1].info(f"⏳ Generating {mcq_chunk_label(chunk)}...")
+    run_mcq_chunks(api_key, chunks, range(len(chunks)), placeholders)
+    
+    bank = get_mcq_bank()
+    added = []
+    with get_storage_lock():
+        for chunk in chunks:
+            if chunk['error'] is None:
+                for question in chunk['records']:
+                    question['id'] = bank['next_id']
+                    bank['next_id'] += 1
+                    added.append(question)
+                bank['covered_case_ids'].update(chunk['case_ids'])
+        if added:
+            bank['questions'].extend(added)
+            save_mcq_bank(bank)
+    
+    # The finished list is drawn below; keep only the failures on screen
+    for chunk, placeholder in zip(chunks, placeholders):
+        if chunk['error'] is None:
+            placeholder.empty()
+    failed = sum(1 for chunk in chunks if chunk['error'] is not None)
+    if failed:
+        st.warning(f"⚠️ {failed} case(s) could not be turned into questions. Generate again to retry just those.")
+    return added
+
 def generate_mcqs_from_cases():
     """Generate Primary FRCA-style MCQs based on saved cases - IMPROVED VERSION"""
     st.markdown("## 📝 Primary FRCA Practice MCQs")
@@ -70,125 +306,52 @@ def generate_mcqs_from_cases():
         st.warning("No cases with sufficient detail found. Add more details to your cases to generate better MCQs!")
         return
     
-    st.success(f"✅ Found {len(clinical_cases)} cases with clinical information!")
+    # Only cases without questions in the bank need an API call
+    bank = get_mcq_bank()
+    new_cases = [c for c in clinical_cases if c['id'] not in bank['covered_case_ids']]
+    
+    st.success(f"✅ Found {len(clinical_cases)} cases with clinical information! "
+               f"{len(bank['questions'])} question(s) saved in your MCQ bank.")
+    if new_cases:
+        st.caption(f"{len(new_cases)} case(s) have no questions yet; generating will add questions for up to "
+                   f"{MCQ_MAX_NEW_CASES_PER_RUN} of them.")
     
-    num_questions = st.slider("Number of questions to generate", 1, 10, 5)
+    num_questions = st.slider("Number of questions to show", 1, 10, 5, help="New questions come first, topped up with questions already in your bank")
     
     if st.button("🎲 Generate MCQs", type="primary"):
-        with st.spinner("Generating MCQs from your cases..."):
+        new_questions = []
+        if new_cases:
             # Check if API key is available
-            if not st.session_state.get('anthropic_api_key'):
+            if st.session_state.get('anthropic_api_key'):
+                new_questions = add_mcqs_to_bank(st.session_state.anthropic_api_key, new_cases[:MCQ_MAX_NEW_CASES_PER_RUN])
+            elif not bank['questions']:
                 st.error("Please enter your Anthropic API key in the AI Assistant section first!")
                 return
-            
-            # Sample cases for MCQ generation
-            sampled_cases = random.sample(clinical_cases, min(num_questions, len(clinical_cases)))
-            
-            # IMPROVED: Prepare context with ALL available information
-            cases_summary = []
-            for case in sampled_cases:
-                summary_parts = []
-                
-                # Assessment type
-                assessment_type = case.get('assessment_type', 'case')
-                if assessment_type != 'case':
-                    summary_parts.append(f"Assessment: {ASSESSMENT_TYPES.get(assessment_type, assessment_type)}")
-                
-                # Core details
-                if case.get('procedure'):
-                    summary_parts.append(f"Procedure: {case['procedure']}")
-                if case.get('operation_type'):
-                    summary_parts.append(f"Specialty: {case['operation_type']}")
-                if case.get('anaesthetic_type'):
-                    summary_parts.append(f"Anaesthetic: {case['anaesthetic_type']}")
-                if case.get('urgency'):
-                    summary_parts.append(f"Urgency: {case['urgency']}")
-                if case.get('age_category'):
-                    summary_parts.append(f"Patient: {case['age_category']}")
-                if case.get('asa_grade'):
-                    summary_parts.append(f"ASA: {case['asa_grade']}")
-                if case.get('supervision_level'):
-                    summary_parts.append(f"Role: {case['supervision_level']}")
-                
-                # Clinical content
-                if case.get('notes'):
-                    summary_parts.append(f"Notes: {case['notes'][:300]}")
-                if case.get('reflection'):
-                    summary_parts.append(f"Reflection: {case['reflection'][:200]}")
-                if case.get('learning'):
-                    summary_parts.append(f"Learning: {case['learning'][:200]}")
-                
-                # CBD/CEX scores
-                if case.get('cbd_scores'):
-                    scores_text = ', '.join([f"{k}: {v}" for k, v in case['cbd_scores'].items() if v])
-                    if scores_text:
-                        summary_parts.append(f"CBD scores: {scores_text}")
-                if case.get('cex_scores'):
-                    scores_text = ', '.join([f"{k}: {v}" for k, v in case['cex_scores'].items() if v])
-                    if scores_text:
-                        summary_parts.append(f"CEX scores: {scores_text}")
-                
-                cases_summary.append(' | '.join(summary_parts))
-            
-            prompt = f"""Based on these anaesthetic cases from my clinical practice, generate {num_questions} Primary FRCA-style MCQ questions (SBA format - one best answer from 5 options).
-
-My Cases:
-{chr(10).join([f"{i+1}. {s}" for i, s in enumerate(cases_summary)])}
-
-For each question:
-1. Create a realistic clinical scenario based on the cases above
-2. Ask a question relevant to Primary FRCA (pharmacology, physiology, physics, clinical anaesthesia)
-3. Provide 5 options (A-E) with ONE best answer
-4. Include a brief explanation of the correct answer
-
-Format each question as:
-QUESTION X:
-[Clinical scenario and question]
-A) [option]
-B) [option]
-C) [option]
-D) [option]
-E) [option]
-
-ANSWER: [Letter]
-EXPLANATION: [Brief explanation]
-
----"""
-            
-            try:
-                response = requests.post(
-                    "https://api.anthropic.com/v1/messages",
-                    headers={
-                        "x-api-key": st.session_state.anthropic_api_key,
-                        "anthropic-version": "2023-06-01",
-                        "content-type": "application/json"
-                    },
-                    json={
-                        "model": "claude-sonnet-4-20250514",
-                        "max_tokens": 4000,
-                        "messages": [{"role": "user", "content": prompt}]
-                    }
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    mcqs_text = result['content'][0]['text']
-                    
-                    st.success(f"✅ Generated {num_questions} MCQs from your cases!")
-                    st.markdown("---")
-                    st.markdown(mcqs_text)
-                    
-                    # Download button
-                    st.download_button(
-                        "📥 Download MCQs",
-                        data=mcqs_text,
-                        file_name=f"frca_mcqs_{datetime.now().strftime('%Y%m%d')}.txt",
-                        mime="text/plain"
-                    )
-                else:
-                    st.error(f"Error generating MCQs: {response.status_code}")
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
+            else:
+                st.warning("Enter your Anthropic API key in the AI Assistant section to add questions for new cases. Showing questions from your bank.")
+        
+        # New questions first, topped up with a random draw from the rest of the bank
+        selection = [q['id'] for q in new_questions[:num_questions]]
+        others = [q['id'] for q in bank['questions'] if q['id'] not in selection]
+        selection += random.sample(others, min(num_questions - len(selection), len(others)))
+        st.session_state.mcq_selection = selection
+    
+    by_id = {q['id']: q for q in bank['questions']}
+    shown = [by_id[i] for i in st.session_state.get('mcq_selection', []) if i in by_id]
+    if not shown:
+        return
+    
+    st.markdown("---")
+    for number, question in enumerate(shown, 1):
+        show_mcq(st.empty(), question, number)
+    
+    # Download button
+    st.download_button(
+        "📥 Download MCQs",
+        data='\n\n---\n\n'.join(format_mcq(q, n) for n, q in enumerate(shown, 1)),
+        file_name=f"frca_mcqs_{datetime.now().strftime('%Y%m%d')}.txt",
+        mime="text/plain"
+    )
 
 # Page config
 st.set_page_config(
@@ -264,19 +427,530 @@ st.markdown("""
         font-size: 0.75rem;
         margin: 0.25rem;
     }
+    .coverage-table {
+        border-collapse: collapse;
+        font-size: 0.75rem;
+        width: 100%;
+    }
+    .coverage-table th, .coverage-table td {
+        border: 1px solid #e5e7eb;
+        padding: 0.25rem 0.4rem;
+        text-align: center;
+    }
+    .coverage-table th:first-child {
+        text-align: left;
+        white-space: nowrap;
+    }
+    .coverage-gap {
+        background: #fee2e2;
+        color: #991b1b;
+    }
 </style>
 """, unsafe_allow_html=True)
 
 # Data file path
 DATA_FILE = "case_logger_data.json"
 
-# Initialize session state
-if 'cases' not in st.session_state:
+# Storage backend: 'json' rewrites DATA_FILE on every change, 'journal' appends one
+# compact record per change to JOURNAL_FILE and folds it into DATA_FILE in the
+# background once the journal passes JOURNAL_COMPACT_BYTES, 'sqlite' keeps one
+# indexed row per case in DB_FILE and only writes the rows that changed
+STORAGE_BACKEND = os.environ.get('CASE_LOGGER_STORAGE', 'json')
+JOURNAL_FILE = "case_logger_data.journal"
+JOURNAL_COMPACTING_FILE = JOURNAL_FILE + ".compacting"
+JOURNAL_COMPACT_BYTES = 512 * 1024
+DB_FILE = "case_logger_data.db"
+
+# The json backend saves from a background thread: a burst of changes is
+# coalesced into one write once it has been quiet for SAVE_DEBOUNCE_SECONDS,
+# but a steady stream of changes is never held back past SAVE_MAX_DELAY_SECONDS
+SAVE_DEBOUNCE_SECONDS = 0.5
+SAVE_MAX_DELAY_SECONDS = 3.0
+
+# Stats aggregate persisted next to the data for the json and journal backends
+STATS_FILE = "case_logger_stats.json"
+
+# Case fields in the full-text search index, with the weight a word earns in each
+SEARCH_FIELDS = {'procedure': 3, 'supervisor': 2, 'notes': 1, 'reflection': 1, 'learning': 1}
+SEARCH_TOKEN_RE = re.compile(r'\w+')
+
+# Parsed practice MCQs, plus the ids of every case that already has questions
+MCQ_BANK_FILE = "case_logger_mcq_bank.json"
+
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id INTEGER NOT NULL UNIQUE,
+    date TEXT NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    exported INTEGER NOT NULL DEFAULT 0,
+    assessment_type TEXT,
+    operation_type TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cases_date ON cases (date);
+CREATE INDEX IF NOT EXISTS idx_cases_completed ON cases (completed, date);
+CREATE INDEX IF NOT EXISTS idx_cases_exported ON cases (exported);
+CREATE INDEX IF NOT EXISTS idx_cases_assessment_type ON cases (assessment_type);
+CREATE INDEX IF NOT EXISTS idx_cases_operation_type ON cases (operation_type);
+"""
+
+DB_UPSERT = """
+INSERT INTO cases (id, date, completed, exported, assessment_type, operation_type, data)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    date = excluded.date,
+    completed = excluded.completed,
+    exported = excluded.exported,
+    assessment_type = excluded.assessment_type,
+    operation_type = excluded.operation_type,
+    data = excluded.data
+"""
+
+# Cases per (EPA, month, assessment type), each case counted once per EPA
+DB_EPA_COVERAGE = """
+SELECT epa, month, assessment_type, COUNT(*) FROM (
+    SELECT DISTINCT cases.id, linked.value AS epa, substr(cases.date, 1, 7) AS month, cases.assessment_type
+    FROM cases, json_each(cases.data, '$.linked_to') AS linked
+    WHERE linked.type = 'text'
+)
+GROUP BY epa, month, assessment_type
+"""
+
+@st.cache_resource
+def get_storage_lock():
+    """Process-wide lock serialising case mutations, journal appends and SQLite access"""
+    return threading.RLock()
+
+@st.cache_resource
+def get_journal_compactor():
+    """Process-wide handle on the background journal compaction, if one is running"""
+    return {'thread': None}
+
+@st.cache_resource
+def get_db():
+    """Open the shared SQLite connection, migrating DATA_FILE on first use"""
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.executescript(DB_SCHEMA)
+    
+    # user_version marks a database that has already imported the JSON file,
+    # so deleting every case later does not resurrect the old data
+    if conn.execute('PRAGMA user_version').fetchone()[0] == 0:
+        if os.path.exists(DATA_FILE):
+            with open(DATA_FILE, 'r') as f:
+                with conn:
+                    conn.executemany(DB_UPSERT, [case_to_row(c) for c in json.load(f)])
+        conn.execute('PRAGMA user_version = 1')
+    return conn
+
+def case_to_row(case):
+    """Flatten a case into the indexed columns plus its JSON body"""
+    return (
+        case['id'],
+        case['date'],
+        int(case.get('completed', False)),
+        int(case.get('exported', False)),
+        case.get('assessment_type', 'case'),
+        case.get('operation_type', ''),
+        json.dumps(case)
+    )
+
+def write_sqlite(ops):
+    """Apply a batch of case changes to the SQLite store in one transaction"""
+    conn = get_db()
+    with get_storage_lock(), conn:
+        for op in ops:
+            if op['op'] in ('add', 'update'):
+                conn.execute(DB_UPSERT, case_to_row(op['case']))
+            elif op['op'] == 'delete':
+                conn.execute('DELETE FROM cases WHERE id = ?', (op['id'],))
+            elif op['op'] == 'toggle':
+                # field is always 'completed' or 'exported', both indexed columns
+                conn.execute(
+                    f"UPDATE cases SET {op['field']} = ?, data = json_set(data, '$.' || ?, json(?)) WHERE id = ?",
+                    (int(op['value']), op['field'], json.dumps(op['value']), op['id'])
+                )
+
+def read_journal(path):
+    """Yield operation records from a journal file, skipping torn lines"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A crash mid-append can leave a partial last line
+                continue
+
+def apply_journal_op(cases_by_id, op):
+    """Apply one journal record to an id-keyed dict of cases.
+
+    Every record carries the resulting value rather than a delta, so replaying
+    the same record twice (e.g. after a crash during compaction) is harmless.
+    """
+    if op['op'] in ('add', 'update'):
+        cases_by_id[op['case']['id']] = op['case']
+    elif op['op'] == 'delete':
+        cases_by_id.pop(op['id'], None)
+    elif op['op'] == 'toggle':
+        if op['id'] in cases_by_id:
+            cases_by_id[op['id']][op['field']] = op['value']
+
+def write_file_atomically(path, text):
+    """Write to a temp file and rename it over path so readers never see a partial file"""
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(text)
+    os.replace(tmp_file, path)
+
+def compact_journal(snapshot, lock):
+    """Write a fresh DATA_FILE snapshot and drop the rotated journal it replaces"""
+    text = json.dumps(snapshot, indent=2)
+    # The lock keeps a load-time recovery from writing DATA_FILE at the same time
+    with lock:
+        write_file_atomically(DATA_FILE, text)
+        try:
+            os.remove(JOURNAL_COMPACTING_FILE)
+        except FileNotFoundError:
+            pass
+
+def load_cases():
+    """Load cases from the snapshot, replaying the journal tail in journal mode"""
+    if STORAGE_BACKEND == 'sqlite':
+        with get_storage_lock():
+            rows = get_db().execute('SELECT data FROM cases ORDER BY rowid').fetchall()
+        return [json.loads(data) for (data,) in rows]
+    
+    cases = []
     if os.path.exists(DATA_FILE):
         with open(DATA_FILE, 'r') as f:
-            st.session_state.cases = json.load(f)
+            cases = json.load(f)
+    
+    if STORAGE_BACKEND == 'journal':
+        cases_by_id = {c['id']: c for c in cases}
+        for path in (JOURNAL_COMPACTING_FILE, JOURNAL_FILE):
+            for op in read_journal(path):
+                apply_journal_op(cases_by_id, op)
+        cases = list(cases_by_id.values())
+        
+        # Terminate a torn final record so the next append starts on a fresh line
+        if os.path.exists(JOURNAL_FILE) and os.path.getsize(JOURNAL_FILE) > 0:
+            with open(JOURNAL_FILE, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+        
+        # Finish a compaction that was interrupted before it removed its journal,
+        # unless this process is still running it in the background
+        compaction = get_journal_compactor()['thread']
+        if os.path.exists(JOURNAL_COMPACTING_FILE) and not (compaction and compaction.is_alive()):
+            compact_journal(cases, get_storage_lock())
+    
+    return cases
+
+def append_journal(ops):
+    """Append operation records to the journal, rotating it for compaction when large"""
+    lines = ''.join(json.dumps(op, separators=(',', ':')) + '\n' for op in ops)
+    with get_storage_lock():
+        with open(JOURNAL_FILE, 'a') as f:
+            f.write(lines)
+            size = f.tell()
+        
+        if size >= JOURNAL_COMPACT_BYTES and not os.path.exists(JOURNAL_COMPACTING_FILE):
+            # Rotate under the lock so later appends start a new journal, then
+            # serialise the snapshot off the script thread
+            snapshot = [dict(c) for c in st.session_state.cases]
+            os.replace(JOURNAL_FILE, JOURNAL_COMPACTING_FILE)
+            compaction = threading.Thread(target=compact_journal, args=(snapshot, get_storage_lock()), daemon=True)
+            get_journal_compactor()['thread'] = compaction
+            compaction.start()
+
+def empty_stats():
+    """Stats aggregate: per-date case counts for the rolling "This Week" figure and
+    EPA coverage counters (EPA -> month or assessment type -> cases)"""
+    return {'total': 0, 'complete': 0, 'exported': 0, 'by_date': {}, 'epa_by_month': {}, 'epa_by_type': {}}
+
+def bump_count(counts, key, sign):
+    """Adjust one counter, dropping it when it reaches zero"""
+    count = counts.get(key, 0) + sign
+    if count:
+        counts[key] = count
+    else:
+        counts.pop(key, None)
+
+def track_case(stats, case, sign):
+    """Add (sign=1) or remove (sign=-1) one case's contribution to the stats aggregate"""
+    stats['total'] += sign
+    if case.get('completed', False):
+        stats['complete'] += sign
+    if case.get('exported', False):
+        stats['exported'] += sign
+    
+    bump_count(stats['by_date'], case['date'], sign)
+    
+    month = case['date'][:7]
+    assessment_type = case.get('assessment_type', 'case')
+    for epa in set(case.get('linked_to') or ()):
+        for counters, key in ((stats['epa_by_month'], month), (stats['epa_by_type'], assessment_type)):
+            counts = counters.setdefault(epa, {})
+            bump_count(counts, key, sign)
+            if not counts:
+                del counters[epa]
+
+def storage_signature():
+    """Size and mtime of the files backing the cases, used to spot stale data"""
+    if STORAGE_BACKEND == 'sqlite':
+        paths = (DB_FILE, DB_FILE + '-wal')
     else:
-        st.session_state.cases = []
+        paths = (DATA_FILE, JOURNAL_FILE, JOURNAL_COMPACTING_FILE)
+    
+    signature = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append([path, stat.st_size, stat.st_mtime_ns])
+    return signature
+
+def save_stats(stats):
+    """Persist the stats aggregate along with the signature of the data it describes"""
+    write_file_atomically(STATS_FILE, json.dumps({'signature': storage_signature(), 'stats': stats}, separators=(',', ':')))
+
+def load_stats(cases):
+    """Load the stats aggregate, rebuilding it when it no longer matches the data"""
+    if STORAGE_BACKEND == 'sqlite':
+        conn = get_db()
+        with get_storage_lock():
+            by_date = dict(conn.execute('SELECT date, COUNT(*) FROM cases GROUP BY date').fetchall())
+            complete = conn.execute('SELECT COUNT(*) FROM cases WHERE completed = 1').fetchone()[0]
+            exported = conn.execute('SELECT COUNT(*) FROM cases WHERE exported = 1').fetchone()[0]
+            epa_rows = conn.execute(DB_EPA_COVERAGE).fetchall()
+        stats = {'total': sum(by_date.values()), 'complete': complete, 'exported': exported, 'by_date': by_date,
+                 'epa_by_month': {}, 'epa_by_type': {}}
+        for epa, month, assessment_type, count in epa_rows:
+            bump_count(stats['epa_by_month'].setdefault(epa, {}), month, count)
+            bump_count(stats['epa_by_type'].setdefault(epa, {}), assessment_type, count)
+        return stats
+    
+    if os.path.exists(STATS_FILE):
+        try:
+            with open(STATS_FILE, 'r') as f:
+                saved = json.load(f)
+            # Files written before a counter existed lack its key and are rebuilt
+            if (saved['signature'] == storage_signature() and saved['stats']['total'] == len(cases)
+                    and saved['stats'].keys() == empty_stats().keys()):
+                return saved['stats']
+        except (json.JSONDecodeError, KeyError, TypeError):
+            pass
+    
+    stats = empty_stats()
+    for case in cases:
+        track_case(stats, case, 1)
+    return stats
+
+def tokenize(text):
+    """Case-folded word tokens of a piece of text"""
+    return SEARCH_TOKEN_RE.findall(text.casefold())
+
+def empty_search_index():
+    """Inverted index: word -> {case id: weight}, plus a sorted word list for prefix lookups"""
+    return {'postings': {}, 'terms': [], 'case_terms': {}}
+
+def index_case(index, case, sort_terms=True):
+    """Add a case's searchable text to the index"""
+    weights = {}
+    for field, weight in SEARCH_FIELDS.items():
+        for term in tokenize(str(case.get(field) or '')):
+            weights[term] = weights.get(term, 0) + weight
+    index['case_terms'][case['id']] = weights
+    for term, weight in weights.items():
+        postings = index['postings'].get(term)
+        if postings is None:
+            postings = index['postings'][term] = {}
+            if sort_terms:
+                bisect.insort(index['terms'], term)
+        postings[case['id']] = weight
+
+def unindex_case(index, case_id):
+    """Remove a case from the index, dropping words no other case uses"""
+    for term in index['case_terms'].pop(case_id, {}):
+        postings = index['postings'][term]
+        postings.pop(case_id, None)
+        if not postings:
+            del index['postings'][term]
+            del index['terms'][bisect.bisect_left(index['terms'], term)]
+
+def build_search_index(cases):
+    """Index every case, sorting the word list once at the end"""
+    index = empty_search_index()
+    for case in cases:
+        index_case(index, case, sort_terms=False)
+    index['terms'] = sorted(index['postings'])
+    return index
+
+@st.cache_resource
+def get_case_store():
+    """Process-wide case store shared by every browser session"""
+    return {
+        'signature': None,
+        # Bumped on every change so derived payloads know when they are stale
+        'version': 0,
+        'cases': [],
+        # id -> case for constant-time lookups; values are the same dicts as in the list
+        'case_index': {},
+        # Highest case id handed out, so new ids never collide with imported ones
+        'last_case_id': 0,
+        'case_stats': empty_stats(),
+        # case id -> formatted LLP text, least recently used first
+        'export_cache': OrderedDict(),
+        'search_index': empty_search_index(),
+        # Analytics tables for the data version they were computed from
+        'analytics': None
+    }
+
+@st.cache_resource
+def get_save_worker():
+    """Start the background thread that writes DATA_FILE for the json backend"""
+    lock = get_storage_lock()
+    worker = {
+        'store': get_case_store(),
+        'lock': lock,
+        # Notified when a write finishes, for callers waiting on the one in flight
+        'idle': threading.Condition(lock),
+        'wake': threading.Event(),
+        'pending': 0,
+        'first_request': 0.0,
+        'last_request': 0.0,
+        'writing': False
+    }
+    threading.Thread(target=run_save_worker, args=(worker,), daemon=True).start()
+    # Anything still pending is written before the process exits
+    atexit.register(flush_saves, worker)
+    return worker
+
+def mark_dirty(worker):
+    """Record a pending change and wake the save worker"""
+    now = time.monotonic()
+    with worker['lock']:
+        if not worker['pending']:
+            worker['first_request'] = now
+        worker['pending'] += 1
+        worker['last_request'] = now
+    worker['wake'].set()
+
+def run_save_worker(worker):
+    """Wait for changes to settle, then write them in one go"""
+    while True:
+        worker['wake'].wait()
+        while True:
+            due = min(worker['last_request'] + SAVE_DEBOUNCE_SECONDS,
+                      worker['first_request'] + SAVE_MAX_DELAY_SECONDS)
+            now = time.monotonic()
+            if now >= due:
+                break
+            time.sleep(due - now)
+        
+        try:
+            flush_saves(worker)
+        except Exception:
+            # The thread must outlive a failed write: keep the change pending and
+            # try again after a fresh debounce window
+            logging.getLogger(__name__).exception("Saving cases failed; retrying")
+            with worker['lock']:
+                worker['pending'] = max(worker['pending'], 1)
+                worker['first_request'] = worker['last_request'] = time.monotonic()
+            worker['wake'].set()
+
+def flush_saves(worker):
+    """Atomically write the shared cases and stats if any change is pending"""
+    store = worker['store']
+    with worker['lock']:
+        worker['wake'].clear()
+        # Let a write in flight finish first, so the exit hook never returns while
+        # the last batch is half written and two writes never share the temp file
+        while worker['writing']:
+            worker['idle'].wait()
+        if not worker['pending']:
+            return
+        # Serialise under the lock so the snapshot is consistent, write outside it
+        cases_text = json.dumps(store['cases'], indent=2)
+        case_stats = store['case_stats']
+        stats = {
+            **case_stats,
+            'by_date': dict(case_stats['by_date']),
+            'epa_by_month': {epa: dict(counts) for epa, counts in case_stats['epa_by_month'].items()},
+            'epa_by_type': {epa: dict(counts) for epa, counts in case_stats['epa_by_type'].items()}
+        }
+        # Claimed only once serialising succeeded, so a failure leaves the change pending
+        worker['pending'] = 0
+        worker['writing'] = True
+    
+    try:
+        write_file_atomically(DATA_FILE, cases_text)
+    finally:
+        with worker['lock']:
+            worker['writing'] = False
+            worker['idle'].notify_all()
+            store['signature'] = storage_signature()
+            save_stats(stats)
+
+def get_pending_saves():
+    """Number of changes not yet on disk (a write in progress counts as one)"""
+    if STORAGE_BACKEND != 'json':
+        return 0
+    worker = get_save_worker()
+    return worker['pending'] + int(worker['writing'])
+
+@st.cache_resource
+def get_mcq_bank():
+    """Process-wide MCQ bank, loaded from MCQ_BANK_FILE on first use"""
+    bank = {'questions': [], 'covered_case_ids': set(), 'next_id': 1}
+    if os.path.exists(MCQ_BANK_FILE):
+        with open(MCQ_BANK_FILE, 'r') as f:
+            data = json.load(f)
+        bank['questions'] = data.get('questions', [])
+        bank['covered_case_ids'] = set(data.get('covered_case_ids', []))
+        bank['next_id'] = max((q['id'] for q in bank['questions']), default=0) + 1
+    return bank
+
+def save_mcq_bank(bank):
+    """Write the MCQ bank to MCQ_BANK_FILE"""
+    write_file_atomically(MCQ_BANK_FILE, json.dumps({
+        'questions': bank['questions'],
+        'covered_case_ids': sorted(bank['covered_case_ids'])
+    }, indent=2))
+
+def sync_case_store():
+    """Point this session at the shared store, reloading it if the data changed on disk"""
+    store = get_case_store()
+    with get_storage_lock():
+        # Our own unsaved changes must never be replaced by what is on disk
+        if store['signature'] != storage_signature() and not get_pending_saves():
+            cases = load_cases()
+            store['cases'] = cases
+            store['case_index'] = {c['id']: c for c in cases}
+            store['last_case_id'] = max(store['case_index'], default=0)
+            store['case_stats'] = load_stats(cases)
+            store['export_cache'] = OrderedDict()
+            store['search_index'] = build_search_index(cases)
+            # Loading can itself tidy the journal, so sign what is on disk now
+            store['signature'] = storage_signature()
+            store['version'] += 1
+    
+    # Sessions share these objects rather than holding private copies; they are
+    # only ever changed through the mutation functions, under the storage lock
+    for key in ('cases', 'case_index', 'case_stats', 'export_cache', 'search_index'):
+        st.session_state[key] = store[key]
+    st.session_state.data_version = store['version']
+
+# Initialize session state
+sync_case_store()
+
+if 'prepared_exports' not in st.session_state:
+    st.session_state.prepared_exports = set()
+
+if 'selected_cases' not in st.session_state:
+    st.session_state.selected_cases = set()
 
 # Check for smart reminders (5pm-5:30pm)
 check_smart_reminders()
@@ -612,6 +1286,29 @@ ALL_SURGICAL_PROCEDURES = sorted(list(set(ALL_SURGICAL_PROCEDURES)))  # Remove d
 # Specialty list
 SPECIALTIES = sorted(list(PROCEDURES_BY_SPECIALTY.keys()))
 
+# Fuzzy procedure finder: every (procedure, specialty) pair, indexed by word trigrams
+PROCEDURE_FINDER_LIMIT = 8
+PROCEDURE_FINDER_MIN_SCORE = 0.3
+
+def procedure_trigrams(text):
+    """Trigrams of each case-folded word, padded so word starts weigh more"""
+    grams = set()
+    for word in re.findall(r'\w+', text.casefold()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+PROCEDURE_ENTRIES = [(procedure, specialty) for specialty, procedures in PROCEDURES_BY_SPECIALTY.items()
+                     for procedure in procedures]
+PROCEDURE_ENTRIES += [(procedure, 'Anaesthetic Procedure') for procedure in COMMON_PROCEDURES]
+PROCEDURE_TRIGRAM_COUNTS = []
+PROCEDURE_TRIGRAM_INDEX = {}
+for entry_id, (procedure, _) in enumerate(PROCEDURE_ENTRIES):
+    grams = procedure_trigrams(procedure)
+    PROCEDURE_TRIGRAM_COUNTS.append(len(grams))
+    for gram in grams:
+        PROCEDURE_TRIGRAM_INDEX.setdefault(gram, []).append(entry_id)
+
 # EPA suggestions for different assessment types
 EPA_SUGGESTIONS = {
     'cbd': {
@@ -655,6 +1352,21 @@ EPA_SUGGESTIONS = {
     }
 }
 
+def compile_epa_matcher(suggestions_map):
+    """Compile a suggestion table into one word-bounded regex plus the keywords each hit implies
+    
+    The lookahead lets overlapping keywords all match. Only the longest keyword
+    starting at a given word is captured, so each keyword also implies the
+    shorter keywords it contains.
+    """
+    keywords = sorted((k for k in suggestions_map if k != 'default'), key=len, reverse=True)
+    pattern = re.compile(r'(?=\b(' + '|'.join(re.escape(k) for k in keywords) + r')\b)')
+    implied = {k: {other for other in keywords if re.search(r'\b' + re.escape(other) + r'\b', k)} for k in keywords}
+    return pattern, implied
+
+EPA_MATCHERS = {assessment_type: compile_epa_matcher(suggestions_map)
+                for assessment_type, suggestions_map in EPA_SUGGESTIONS.items()}
+
 SURGICAL_PROCEDURES = [
     # General Surgery
     'Laparoscopic Cholecystectomy',
@@ -894,45 +1606,191 @@ LEARNING_TEMPLATES = {
     'Failed Intubation': 'Valuable learning on crisis resource management, following algorithms under pressure, and importance of early escalation. Reviewed DAS guidelines in detail afterwards.'
 }
 
+# Score scales for the CBD/CEX competency areas
+CBD_SCORES = ('', 'Below expectations', 'Meets expectations', 'Above expectations', 'Excellent')
+CEX_SCORES = ('', '1 - Below expectations', '2 - Borderline', '3 - Meets expectations', '4 - Above expectations', '5 - Excellent')
+
+# Form dropdowns, built once at import: each selectbox's options as a tuple and a
+# read-only value -> position map, so rendering the form never sorts or searches a list
+def option_index(options):
+    """Read-only map from each option to its first position"""
+    index = {}
+    for position, value in enumerate(options):
+        index.setdefault(value, position)
+    return MappingProxyType(index)
+
+SPECIALTY_OPTIONS = ('',) + tuple(SPECIALTIES) + ('Anaesthetic Procedure', 'Other')
+TIME_OF_DAY_OPTIONS = tuple(TIME_OF_DAY)
+ASA_OPTIONS = ('',) + tuple(ASA_GRADES)
+URGENCY_OPTIONS = ('',) + tuple(URGENCY_TYPES)
+ANAESTHETIC_OPTIONS = ('',) + tuple(ANAESTHETIC_TYPES)
+SUPERVISION_OPTIONS = ('',) + tuple(SUPERVISION_LEVELS)
+CASE_TYPE_OPTIONS = ('',) + tuple(CASE_TYPES)
+
+SPECIALTY_OPTION_INDEX = option_index(SPECIALTY_OPTIONS)
+TIME_OF_DAY_OPTION_INDEX = option_index(TIME_OF_DAY_OPTIONS)
+ASA_OPTION_INDEX = option_index(ASA_OPTIONS)
+URGENCY_OPTION_INDEX = option_index(URGENCY_OPTIONS)
+ANAESTHETIC_OPTION_INDEX = option_index(ANAESTHETIC_OPTIONS)
+SUPERVISION_OPTION_INDEX = option_index(SUPERVISION_OPTIONS)
+CASE_TYPE_OPTION_INDEX = option_index(CASE_TYPE_OPTIONS)
+CBD_SCORE_INDEX = option_index(CBD_SCORES)
+CEX_SCORE_INDEX = option_index(CEX_SCORES)
+
+# Procedure dropdown for each specialty choice, pre-sorted
+PROCEDURE_OPTIONS = MappingProxyType({
+    **{specialty: ('',) + tuple(sorted(procedures)) + ('Other (type below)',)
+       for specialty, procedures in PROCEDURES_BY_SPECIALTY.items()},
+    'Anaesthetic Procedure': ('',) + tuple(sorted(COMMON_PROCEDURES)) + ('Other (type below)',),
+    'Other': ('',) + tuple(ALL_SURGICAL_PROCEDURES) + ('Other (type below)',),
+    '': ('', 'Please select a specialty first', 'Other (type below)')
+})
+PROCEDURE_OPTION_INDEX = MappingProxyType({specialty: option_index(options) for specialty, options in PROCEDURE_OPTIONS.items()})
+
+# Case-insensitive lookups used to validate imported values against the option lists
+IMPORT_OPTIONS = MappingProxyType({
+    'assessment_type': MappingProxyType({
+        spelling.casefold(): key
+        for key, label in ASSESSMENT_TYPES.items()
+        for spelling in (key, label, label.split(' - ')[0])
+    }),
+    **{
+        field: MappingProxyType({str(option).casefold(): option for option in options if option})
+        for field, options in {
+            'time': TIME_OF_DAY_OPTIONS,
+            'operation_type': SPECIALTY_OPTIONS,
+            'case_type': CASE_TYPE_OPTIONS,
+            'urgency': URGENCY_OPTIONS,
+            'asa_grade': ASA_OPTIONS,
+            'anaesthetic_type': ANAESTHETIC_OPTIONS,
+            'supervision_level': SUPERVISION_OPTIONS
+        }.items()
+    }
+})
+EPA_OPTION_LOOKUP = MappingProxyType({
+    **{epa.casefold(): epa for epa in EPA_OPTIONS},
+    **{epa.split(' ')[0].casefold(): epa for epa in EPA_OPTIONS}
+})
+
+# Categorical columns in the analytics DataFrame, with their known categories in
+# display order; values outside these (older or hand-typed ones) are appended
+ANALYTICS_CATEGORIES = {
+    'operation_type': SPECIALTY_OPTIONS[1:],
+    'urgency': URGENCY_OPTIONS[1:],
+    'asa_grade': ASA_OPTIONS[1:],
+    'anaesthetic_type': ANAESTHETIC_OPTIONS[1:],
+    'supervision_level': SUPERVISION_OPTIONS[1:],
+    'assessment_type': tuple(ASSESSMENT_TYPES)
+}
+ANALYTICS_LABELS = {
+    'operation_type': 'Specialty',
+    'urgency': 'Urgency',
+    'asa_grade': 'ASA Grade',
+    'anaesthetic_type': 'Anaesthetic Type',
+    'supervision_level': 'Supervision Level',
+    'assessment_type': 'Assessment Type'
+}
+
+# Bulk import: records validated per chunk, and the case fields each column may map to
+IMPORT_CHUNK_SIZE = 500
+IMPORT_FIELDS = {
+    'date': ('date', 'case date', 'date of case'),
+    'time': ('time', 'time of day'),
+    'assessment_type': ('assessment type', 'assessment', 'sle type'),
+    'procedure': ('procedure', 'operation', 'procedure performed'),
+    'operation_type': ('specialty', 'speciality', 'surgical specialty', 'operation type'),
+    'case_type': ('case type',),
+    'urgency': ('urgency', 'priority'),
+    'asa_grade': ('asa', 'asa grade'),
+    'age_category': ('age', 'patient age', 'age category'),
+    'anaesthetic_type': ('anaesthetic', 'anaesthetic type', 'anaesthesia', 'technique'),
+    'supervision_level': ('supervision', 'supervision level', 'role'),
+    'supervisor': ('supervisor', 'consultant'),
+    'notes': ('notes', 'quick notes', 'comments'),
+    'reflection': ('reflection',),
+    'learning': ('learning', 'learning points'),
+    'linked_to': ('linked to', 'epa', 'epas'),
+    'completed': ('completed', 'complete', 'done'),
+    'exported': ('exported',)
+}
+IMPORT_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y', '%d.%m.%Y')
+IMPORT_TRUE_VALUES = {'1', 'true', 'yes', 'y', 'x', '✓', '✅'}
+IMPORT_MAX_ERRORS_SHOWN = 20
+
+# EPA coverage heatmap: months shown, and how recent evidence must be before a gap is flagged
+COVERAGE_MONTHS = 12
+COVERAGE_GAP_MONTHS = 3
+
+# Formatted LLP texts kept in the shared store before the least recently used is evicted
+EXPORT_CACHE_SIZE = 1000
+
+# Logbook export formats: label, file extension and mime type. Exports are written
+# through a temporary file that moves to disk once it passes EXPORT_SPOOL_BYTES
+EXPORT_FORMATS = {
+    'txt': ('LLP text', 'txt', 'text/plain'),
+    'csv': ('CSV', 'csv', 'text/csv'),
+    'jsonl': ('JSON Lines', 'jsonl', 'application/x-ndjson'),
+    'zip': ('ZIP of case files', 'zip', 'application/zip')
+}
+EXPORT_SPOOL_BYTES = 1024 * 1024
+
+# Case list pagination
+PAGE_SIZE_OPTIONS = [10, 25, 50, 100]
+DEFAULT_PAGE_SIZE = 25
+
+# Batch AI drafting: parallel requests, spaced to stay under the API rate limit
+BATCH_DRAFT_WORKERS = 4
+BATCH_DRAFT_REQUESTS_PER_MINUTE = 40
+BATCH_DRAFT_MAX_TOKENS = 600
+
+# MCQ generation fans out one small request per chunk of sampled cases
+MCQ_CASES_PER_CHUNK = 1
+MCQ_WORKERS = 4
+MCQ_TOKENS_PER_QUESTION = 800
+MCQ_READ_TIMEOUT = 60
+# Cases sent to the API per click when adding to the MCQ bank
+MCQ_MAX_NEW_CASES_PER_RUN = 10
+
+# Layout of generated MCQs, as requested in build_mcq_prompt (tolerating markdown bold)
+MCQ_QUESTION_RE = re.compile(r'^[ \t*#]*QUESTION\s*\d+\**\s*:?\**', re.IGNORECASE | re.MULTILINE)
+MCQ_OPTION_RE = re.compile(r'^[ \t*]*([A-E])[).:]\**\s*(.*)$')
+MCQ_ANSWER_RE = re.compile(r'^[ \t*]*ANSWER\**\s*:?\**\s*\(?([A-E])\b', re.IGNORECASE)
+MCQ_EXPLANATION_RE = re.compile(r'^[ \t*]*EXPLANATION\**\s*:?\**\s*(.*)$', re.IGNORECASE)
+
 # Functions
-def call_claude_api(prompt, max_tokens=1000):
-    """Call Claude API to help generate content"""
+def stream_claude_api(prompt, max_tokens=1000, regenerate=False):
+    """Call Claude API and yield the reply text as it is generated"""
     api_key = st.session_state.get('anthropic_api_key', '')
     
     if not api_key:
-        return "⚠️ Please enter your Anthropic API key in the AI Assistant section to use this feature."
+        yield "⚠️ Please enter your Anthropic API key in the AI Assistant section to use this feature."
+        return
     
-    try:
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers={
-                "Content-Type": "application/json",
-                "anthropic-version": "2023-06-01",
-                "x-api-key": api_key
-            },
-            json={
-                "model": "claude-sonnet-4-20250514",
-                "max_tokens": max_tokens,
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ]
-            },
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            return data['content'][0]['text']
-        elif response.status_code == 401:
-            return "❌ Invalid API key. Please check your key and try again."
-        elif response.status_code == 429:
-            return "⚠️ Rate limit reached. Please wait a moment and try again."
+    yield from anthropic_client.stream_complete(api_key, prompt, max_tokens=max_tokens, regenerate=regenerate)
+
+def write_ai_stream(prompt, max_tokens=1000, as_code=True, regenerate=False):
+    """Render a streamed Claude reply incrementally and return the full text"""
+    placeholder = st.empty()
+    chunks = stream_claude_api(prompt, max_tokens=max_tokens, regenerate=regenerate)
+    text = ''
+    last_render = 0.0
+    done = False
+    while not done:
+        chunk = next(chunks, None)
+        if chunk is None:
+            done = True
         else:
-            return f"❌ Error {response.status_code}: {response.text}"
-    except requests.exceptions.Timeout:
-        return "⚠️ Request timed out. Please check your internet connection and try again."
-    except Exception as e:
-        return f"❌ Error: {str(e)}"
+            text += chunk
+        
+        # Redraw at most ~10 times a second (each redraw resends the whole text),
+        # and always once the stream has finished
+        if done or time.monotonic() - last_render >= 0.1:
+            if as_code:
+                placeholder.code(text, language=None)
+            else:
+                placeholder.markdown(text)
+            last_render = time.monotonic()
+    return text
 
 def generate_reflection_prompt(case_data):
     """Generate a prompt for Claude to help write reflection"""
@@ -976,6 +1834,48 @@ Write insightful learning points as flowing prose (one paragraph, 5-6 sentences)
 Write in first person with genuine clinical insight. Be specific and thoughtful - avoid generic statements. Show evidence of deep reflection and commitment to continuous improvement."""
     return prompt
 
+def draft_case_text(api_key, case, limiter, regenerate=False):
+    """Draft whichever of reflection/learning a case is missing (runs in a worker thread)"""
+    drafts = {}
+    reflection = case.get('reflection', '')
+    if not reflection:
+        reflection = anthropic_client.fetch_reply(api_key, generate_reflection_prompt(case),
+                                                  max_tokens=BATCH_DRAFT_MAX_TOKENS,
+                                                  regenerate=regenerate, limiter=limiter)
+        drafts['reflection'] = reflection
+    if not case.get('learning'):
+        drafts['learning'] = anthropic_client.fetch_reply(api_key, generate_learning_prompt({**case, 'reflection': reflection}),
+                                                          max_tokens=BATCH_DRAFT_MAX_TOKENS,
+                                                          regenerate=regenerate, limiter=limiter)
+    return drafts
+
+def draft_cases(api_key, cases, on_progress=None, regenerate=False):
+    """Draft missing text for many cases concurrently; return (drafts by id, failures)
+    
+    A failed case never stops the batch. Replies land in the response cache as
+    they arrive, so re-running an interrupted batch only pays for what is left.
+    """
+    limiter = anthropic_client.RateLimiter(BATCH_DRAFT_REQUESTS_PER_MINUTE)
+    drafts = {}
+    failures = []
+    pool = ThreadPoolExecutor(max_workers=BATCH_DRAFT_WORKERS)
+    try:
+        # Workers get their own copies; the shared dicts may change under them
+        futures = {pool.submit(draft_case_text, api_key, dict(case), limiter, regenerate): case
+                   for case in cases}
+        for done, future in enumerate(as_completed(futures), 1):
+            case = futures[future]
+            try:
+                drafts[case['id']] = future.result()
+            except Exception as e:
+                failures.append((case, str(e)))
+            if on_progress:
+                on_progress(done, len(cases))
+    finally:
+        # If the rerun is interrupted, drop queued cases instead of finishing them unseen
+        pool.shutdown(wait=False, cancel_futures=True)
+    return drafts, failures
+
 def get_current_time_of_day():
     """Get current time of day based on hour"""
     from datetime import datetime
@@ -989,57 +1889,519 @@ def get_current_time_of_day():
     else:
         return 'Night'
 
-def save_data():
-    """Save cases to JSON file"""
-    with open(DATA_FILE, 'w') as f:
-        json.dump(st.session_state.cases, f, indent=2)
+def persist(ops):
+    """Persist a batch of case changes with the configured storage backend"""
+    store = get_case_store()
+    store['version'] += 1
+    st.session_state.data_version = store['version']
+    
+    # Drop cached export text for every case this batch touches
+    for op in ops:
+        st.session_state.export_cache.pop(op['case']['id'] if 'case' in op else op['id'], None)
+    
+    if STORAGE_BACKEND == 'json':
+        # The save worker writes the file (and re-signs the store) off the script thread
+        mark_dirty(get_save_worker())
+        return
+    
+    if STORAGE_BACKEND == 'journal':
+        append_journal(ops)
+        save_stats(st.session_state.case_stats)
+    else:
+        write_sqlite(ops)
+    
+    # Our own write should not look like an external change to the shared store
+    store['signature'] = storage_signature()
+
+def query_cases(filter_type='all', newest_first=False):
+    """Return the cases shown under a list filter, optionally most recent first"""
+    if STORAGE_BACKEND == 'sqlite':
+        where = {'incomplete': 'WHERE completed = 0', 'complete': 'WHERE completed = 1'}.get(filter_type, '')
+        order = 'ORDER BY date DESC, rowid' if newest_first else 'ORDER BY rowid'
+        with get_storage_lock():
+            rows = get_db().execute(f'SELECT id FROM cases {where} {order}').fetchall()
+        case_index = st.session_state.case_index
+        return [case_index[case_id] for (case_id,) in rows if case_id in case_index]
+    
+    if filter_type == 'incomplete':
+        cases = [c for c in st.session_state.cases if not c.get('completed', False)]
+    elif filter_type == 'complete':
+        cases = [c for c in st.session_state.cases if c.get('completed', False)]
+    else:
+        cases = st.session_state.cases.copy()
+    
+    if newest_first:
+        cases.sort(key=lambda x: x['date'], reverse=True)
+    return cases
+
+def search_cases(query, filter_type='all'):
+    """Cases containing every word of query (each as a prefix), best match first"""
+    terms = tokenize(query)
+    if not terms:
+        return []
+    
+    index = st.session_state.search_index
+    scores = None
+    with get_storage_lock():
+        for term in terms:
+            term_scores = {}
+            words = index['terms']
+            i = bisect.bisect_left(words, term)
+            while i < len(words) and words[i].startswith(term):
+                # Whole-word matches outrank prefix matches
+                factor = 1.0 if words[i] == term else 0.5
+                for case_id, weight in index['postings'][words[i]].items():
+                    term_scores[case_id] = term_scores.get(case_id, 0) + weight * factor
+                i += 1
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {case_id: score + term_scores[case_id] for case_id, score in scores.items() if case_id in term_scores}
+            if not scores:
+                return []
+    
+    case_index = st.session_state.case_index
+    cases = [case_index[case_id] for case_id in scores if case_id in case_index]
+    if filter_type != 'all':
+        completed = filter_type == 'complete'
+        cases = [c for c in cases if c.get('completed', False) == completed]
+    # Ties go to the most recent case
+    cases.sort(key=lambda c: (scores[c['id']], c['date']), reverse=True)
+    return cases
+
+def find_procedures(query, limit=PROCEDURE_FINDER_LIMIT):
+    """Best (procedure, specialty) matches for a possibly misspelt query"""
+    grams = procedure_trigrams(query)
+    if not grams:
+        return []
+    
+    shared = {}
+    for gram in grams:
+        for entry_id in PROCEDURE_TRIGRAM_INDEX.get(gram, ()):
+            shared[entry_id] = shared.get(entry_id, 0) + 1
+    
+    # Rank by how much of the query is found, then by Dice similarity so
+    # shorter, closer names win ties
+    scored = []
+    for entry_id, count in shared.items():
+        coverage = count / len(grams)
+        if coverage >= PROCEDURE_FINDER_MIN_SCORE:
+            dice = 2 * count / (len(grams) + PROCEDURE_TRIGRAM_COUNTS[entry_id])
+            scored.append((coverage, dice, entry_id))
+    return [PROCEDURE_ENTRIES[entry_id] for _, _, entry_id in heapq.nlargest(limit, scored)]
+
+def suggest_epas(assessment_type, text, use_default=True):
+    """EPAs whose keywords appear as whole words in text, in table order without duplicates"""
+    if assessment_type not in EPA_MATCHERS:
+        return []
+    pattern, implied = EPA_MATCHERS[assessment_type]
+    found = set()
+    for match in pattern.finditer(text.lower()):
+        found.update(implied[match.group(1)])
+    
+    suggestions_map = EPA_SUGGESTIONS[assessment_type]
+    suggested_epas = [epa for keyword, epas in suggestions_map.items() if keyword in found for epa in epas]
+    
+    # If no matches, use default
+    if not suggested_epas and use_default:
+        suggested_epas = suggestions_map.get('default', [])
+    
+    # Remove duplicates
+    return list(dict.fromkeys(suggested_epas))
+
+def backfill_epas():
+    """Link keyword-suggested EPAs to every assessment with none linked, in one write"""
+    updates = {}
+    for case in st.session_state.cases:
+        if case.get('assessment_type', 'case') in EPA_MATCHERS and not case.get('linked_to'):
+            epas = suggest_epas(case['assessment_type'], f"{case.get('procedure', '')} {case.get('notes', '')}", use_default=False)
+            if epas:
+                updates[case['id']] = {'linked_to': epas}
+    return update_cases(updates)
+
+def normalize_import_header(header):
+    """Header text as compared against IMPORT_FIELDS aliases"""
+    return ' '.join(re.findall(r'[a-z0-9]+', str(header).casefold()))
+
+def detect_import_mapping(columns):
+    """Guess which case field each source column holds (None to ignore it)"""
+    aliases = {alias: field for field, names in IMPORT_FIELDS.items() for alias in (field.replace('_', ' '), *names)}
+    mapping = {}
+    used = set()
+    for column in columns:
+        field = aliases.get(normalize_import_header(column))
+        mapping[column] = field if field not in used else None
+        used.add(field)
+    return mapping
+
+def iter_import_records(uploaded, file_format):
+    """Yield raw records from an uploaded CSV or JSON Lines file, decoding it as it goes
+    
+    A JSON Lines line that is not an object is yielded as None so it can be reported.
+    """
+    uploaded.seek(0)
+    text = io.TextIOWrapper(uploaded, encoding='utf-8-sig', newline='')
+    try:
+        if file_format == 'csv':
+            yield from csv.DictReader(text)
+        else:
+            for line in text:
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        record = None
+                    yield record if isinstance(record, dict) else None
+    finally:
+        # Leave the upload open for the next rerun
+        text.detach()
+
+def read_import_columns(uploaded, file_format):
+    """Column names from the CSV header or the first JSON Lines object"""
+    if file_format == 'csv':
+        uploaded.seek(0)
+        text = io.TextIOWrapper(uploaded, encoding='utf-8-sig', newline='')
+        try:
+            return next(csv.reader(text), [])
+        finally:
+            text.detach()
+    return next((list(record) for record in iter_import_records(uploaded, file_format) if record is not None), [])
+
+def canonical_option(field, value):
+    """The option-list spelling of value, matched case-insensitively, or None"""
+    return IMPORT_OPTIONS[field].get(value.casefold())
+
+def parse_import_record(record, mapping):
+    """Turn one raw record into a case dict, or return the reason it cannot be imported"""
+    if record is None:
+        return None, "not a JSON object"
+    
+    case = {
+        'assessment_type': 'case', 'date': '', 'time': '', 'age_category': '', 'asa_grade': '',
+        'urgency': '', 'operation_type': '', 'anaesthetic_type': '', 'supervision_level': '',
+        'case_type': '', 'procedure': '', 'supervisor': '', 'notes': '', 'reflection': '',
+        'learning': '', 'linked_to': [], 'completed': False, 'exported': False
+    }
+    for column, field in mapping.items():
+        value = record.get(column)
+        if field is None or value is None or value == '':
+            continue
+        
+        if field == 'linked_to':
+            names = value if isinstance(value, list) else re.split(r'[;|,\n]', str(value))
+            for name in (str(n).strip() for n in names):
+                if not name:
+                    continue
+                # "EPA3" is accepted as shorthand for the full EPA name
+                epa = EPA_OPTION_LOOKUP.get(name.casefold()) or EPA_OPTION_LOOKUP.get(name.split(' ')[0].casefold())
+                if epa is None:
+                    return None, f"unknown EPA '{name}'"
+                if epa not in case['linked_to']:
+                    case['linked_to'].append(epa)
+        elif field in ('completed', 'exported'):
+            case[field] = value if isinstance(value, bool) else str(value).strip().casefold() in IMPORT_TRUE_VALUES
+        elif field == 'date':
+            for date_format in IMPORT_DATE_FORMATS:
+                try:
+                    case['date'] = datetime.strptime(str(value).strip(), date_format).date().isoformat()
+                    break
+                except ValueError:
+                    pass
+            else:
+                return None, f"unrecognised date '{value}'"
+        elif field in IMPORT_OPTIONS:
+            option = canonical_option(field, str(value).strip())
+            if option is None:
+                return None, f"'{value}' is not a valid {field.replace('_', ' ')}"
+            case[field] = option
+        else:
+            case[field] = str(value).strip()
+    
+    if not case['date']:
+        return None, "missing date"
+    return case, None
+
+def case_fingerprint(case):
+    """Identity used to spot a case that is already in the logbook"""
+    return (
+        case['date'],
+        case.get('assessment_type', 'case'),
+        case.get('procedure', '').casefold().strip(),
+        case.get('supervisor', '').casefold().strip(),
+        ' '.join(case.get('notes', '').casefold().split())
+    )
+
+def import_cases(uploaded, file_format, mapping, on_progress=None):
+    """Validate and de-duplicate an uploaded logbook chunk by chunk, then add it in one write
+    
+    Returns (cases added, duplicates skipped, [(record number, reason)] for rejected records).
+    """
+    with get_storage_lock():
+        seen = {case_fingerprint(c) for c in st.session_state.cases}
+    
+    new_cases = []
+    duplicates = 0
+    rejected = []
+    records = enumerate(iter_import_records(uploaded, file_format), 1)
+    while True:
+        chunk = list(islice(records, IMPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+        for number, record in chunk:
+            case, error = parse_import_record(record, mapping)
+            if error:
+                rejected.append((number, error))
+                continue
+            fingerprint = case_fingerprint(case)
+            if fingerprint in seen:
+                duplicates += 1
+                continue
+            seen.add(fingerprint)
+            case['id'] = new_case_id()
+            new_cases.append(case)
+        if on_progress:
+            on_progress(uploaded.tell() / max(uploaded.size, 1))
+    
+    if new_cases:
+        with get_storage_lock():
+            for case in new_cases:
+                insert_case(case)
+            persist([{'op': 'add', 'case': case} for case in new_cases])
+    return len(new_cases), duplicates, rejected
+
+def get_week_cutoff():
+    """Earliest ISO date whose midnight falls within the last seven days"""
+    week_ago = datetime.now() - timedelta(days=7)
+    cutoff = week_ago.date()
+    if week_ago.time() != dt_time(0, 0):
+        cutoff += timedelta(days=1)
+    return cutoff.isoformat()
+
+def get_case(case_id):
+    """Look up a case by id without scanning the list"""
+    return st.session_state.case_index.get(case_id)
+
+def new_case_id():
+    """Millisecond timestamp id for a new case, always past every id already handed out"""
+    store = get_case_store()
+    with get_storage_lock():
+        case_id = max(int(datetime.now().timestamp() * 1000), store['last_case_id'] + 1)
+        store['last_case_id'] = case_id
+    return case_id
+
+def insert_case(case):
+    """Append a case to the ordered list and the id index"""
+    st.session_state.cases.append(case)
+    st.session_state.case_index[case['id']] = case
+    track_case(st.session_state.case_stats, case, 1)
+    index_case(st.session_state.search_index, case)
 
 def add_case(case_data):
     """Add or update a case"""
-    if st.session_state.editing_id is not None:
-        # Update existing case
-        for i, case in enumerate(st.session_state.cases):
-            if case['id'] == st.session_state.editing_id:
-                st.session_state.cases[i] = {**case_data, 'id': st.session_state.editing_id}
-                break
-        st.session_state.editing_id = None
-    else:
-        # Add new case
-        case_data['id'] = int(datetime.now().timestamp() * 1000)
-        st.session_state.cases.append(case_data)
-    
-    save_data()
+    with get_storage_lock():
+        if st.session_state.editing_id is not None:
+            # Update existing case in place so the list and index keep the same dict
+            ops = []
+            case = get_case(st.session_state.editing_id)
+            if case is not None:
+                track_case(st.session_state.case_stats, case, -1)
+                case.clear()
+                case.update({**case_data, 'id': st.session_state.editing_id})
+                track_case(st.session_state.case_stats, case, 1)
+                unindex_case(st.session_state.search_index, case['id'])
+                index_case(st.session_state.search_index, case)
+                ops.append({'op': 'update', 'case': case})
+            st.session_state.editing_id = None
+        else:
+            # Add new case
+            case_data['id'] = new_case_id()
+            insert_case(case_data)
+            ops = [{'op': 'add', 'case': case_data}]
+        
+        persist(ops)
     st.session_state.show_form = False
+    st.session_state.pop('picked_procedure', None)
+
+def duplicate_case(case):
+    """Add a copy of a case dated today, with its status flags reset"""
+    duplicate = case.copy()
+    duplicate['id'] = new_case_id()
+    duplicate['date'] = date.today().isoformat()
+    duplicate['completed'] = False
+    duplicate['exported'] = False  # Reset exported status
+    with get_storage_lock():
+        insert_case(duplicate)
+        persist([{'op': 'add', 'case': duplicate}])
 
 def delete_case(case_id):
     """Delete a case"""
-    st.session_state.cases = [c for c in st.session_state.cases if c['id'] != case_id]
-    save_data()
+    with get_storage_lock():
+        case = st.session_state.case_index.pop(case_id, None)
+        if case is not None:
+            # list.remove matches by identity first and shifts in place, no list copy
+            st.session_state.cases.remove(case)
+            track_case(st.session_state.case_stats, case, -1)
+            unindex_case(st.session_state.search_index, case_id)
+        persist([{'op': 'delete', 'id': case_id}])
+
+def delete_cases(case_ids):
+    """Delete many cases and persist them in one write"""
+    case_ids = set(case_ids)
+    with get_storage_lock():
+        ops = []
+        for case_id in case_ids:
+            case = st.session_state.case_index.pop(case_id, None)
+            if case is not None:
+                track_case(st.session_state.case_stats, case, -1)
+                unindex_case(st.session_state.search_index, case_id)
+                ops.append({'op': 'delete', 'id': case_id})
+        if ops:
+            # One pass over the shared list instead of a remove() per case
+            st.session_state.cases[:] = [c for c in st.session_state.cases if c['id'] not in case_ids]
+            persist(ops)
+    return len(ops)
+
+def set_case_field(case_ids, field, value):
+    """Set one field on many cases in one write, skipping those that already match"""
+    updates = {}
+    for case_id in case_ids:
+        case = get_case(case_id)
+        if case is not None and case.get(field, False) != value:
+            updates[case_id] = {field: value}
+    return update_cases(updates)
+
+def link_epas(case_ids, epas):
+    """Add EPAs to the links of many cases in one write"""
+    updates = {}
+    for case_id in case_ids:
+        case = get_case(case_id)
+        if case is None:
+            continue
+        linked = case.get('linked_to') or []
+        missing = [epa for epa in epas if epa not in linked]
+        if missing:
+            updates[case_id] = {'linked_to': linked + missing}
+    return update_cases(updates)
+
+def sync_case_selection(case_id):
+    """Checkbox callback: mirror a card's checkbox into the bulk selection"""
+    if st.session_state.get(f"select_{case_id}"):
+        st.session_state.selected_cases.add(case_id)
+    else:
+        st.session_state.selected_cases.discard(case_id)
 
 def toggle_complete(case_id):
     """Toggle case completion status"""
-    for case in st.session_state.cases:
-        if case['id'] == case_id:
+    with get_storage_lock():
+        case = get_case(case_id)
+        if case is not None:
+            track_case(st.session_state.case_stats, case, -1)
             case['completed'] = not case.get('completed', False)
-            break
-    save_data()
+            track_case(st.session_state.case_stats, case, 1)
+            persist([{'op': 'toggle', 'id': case_id, 'field': 'completed', 'value': case['completed']}])
 
 def toggle_exported(case_id):
     """Toggle case exported status - NEW FUNCTION"""
-    for case in st.session_state.cases:
-        if case['id'] == case_id:
+    with get_storage_lock():
+        case = get_case(case_id)
+        if case is not None:
+            track_case(st.session_state.case_stats, case, -1)
             case['exported'] = not case.get('exported', False)
-            break
-    save_data()
-
-def export_cases(cases_to_export):
-    """Export cases to text format"""
-    output = []
+            track_case(st.session_state.case_stats, case, 1)
+            persist([{'op': 'toggle', 'id': case_id, 'field': 'exported', 'value': case['exported']}])
+
+def update_cases(updates):
+    """Apply {case_id: {field: value}} to many cases and persist them in one write"""
+    with get_storage_lock():
+        ops = []
+        for case_id, fields in updates.items():
+            case = get_case(case_id)
+            if case is None or not fields:
+                continue
+            track_case(st.session_state.case_stats, case, -1)
+            case.update(fields)
+            track_case(st.session_state.case_stats, case, 1)
+            if any(field in SEARCH_FIELDS for field in fields):
+                unindex_case(st.session_state.search_index, case_id)
+                index_case(st.session_state.search_index, case)
+            ops.append({'op': 'update', 'case': case})
+        if ops:
+            persist(ops)
+    return len(ops)
+
+def iter_text_export(cases_to_export):
+    """Yield the LLP text of each case, separated by blank lines"""
+    for position, case in enumerate(cases_to_export):
+        yield ('\n' if position else '') + format_case_for_export(case)
+
+def iter_csv_export(cases_to_export):
+    """Yield a CSV header and then one row per case, in the columns the importer reads"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    columns = ['id', *IMPORT_FIELDS]
+    writer.writerow(columns)
+    for case in cases_to_export:
+        writer.writerow([
+            '; '.join(case.get(column) or []) if column == 'linked_to' else case.get(column, '')
+            for column in columns
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header only, for an empty export
+        yield buffer.getvalue()
+
+def iter_jsonl_export(cases_to_export):
+    """Yield each case as one JSON object per line"""
     for case in cases_to_export:
-        output.append(format_case_for_export(case))
-    return '\n'.join(output)
+        yield json.dumps(case, ensure_ascii=False) + '\n'
+
+def case_file_name(case, extension='txt'):
+    """Download file name for a single case"""
+    procedure = re.sub(r'[^A-Za-z0-9]+', '_', case.get('procedure') or 'case').strip('_') or 'case'
+    return f"case_{case['date']}_{procedure}.{extension}"
+
+def write_export(cases_to_export, export_format):
+    """Write an export into a spooled temporary file and return its bytes
+    
+    Text formats are encoded chunk by chunk from their generators, and ZIP
+    members are compressed one case at a time, so only the finished file is
+    ever held whole.
+    """
+    with SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as spool:
+        if export_format == 'zip':
+            used_names = set()
+            with zipfile.ZipFile(spool, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                for case in cases_to_export:
+                    name = case_file_name(case)
+                    if name in used_names:
+                        name = case_file_name(case, f"{case['id']}.txt")
+                    used_names.add(name)
+                    archive.writestr(name, format_case_for_export(case))
+        else:
+            chunks = {'txt': iter_text_export, 'csv': iter_csv_export, 'jsonl': iter_jsonl_export}[export_format]
+            for chunk in chunks(cases_to_export):
+                spool.write(chunk.encode('utf-8'))
+        spool.seek(0)
+        return spool.read()
 
 def format_case_for_export(case):
+    """Format a single case for export, reusing the cached text for unchanged cases"""
+    cache = st.session_state.export_cache
+    # The cache is shared, and other sessions' persist() calls pop entries from it
+    with get_storage_lock():
+        text = cache.get(case['id'])
+        if text is None:
+            text = build_case_export(case)
+            cache[case['id']] = text
+            if len(cache) > EXPORT_CACHE_SIZE:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(case['id'])
+    return text
+
+def build_case_export(case):
     """Format a single case for export optimized for LLP copy/paste"""
     lines = []
     
@@ -1147,29 +2509,156 @@ def format_case_for_export(case):
     
     return '\n'.join(lines)
 
-def get_stats():
-    """Calculate statistics"""
-    total = len(st.session_state.cases)
-    complete = sum(1 for c in st.session_state.cases if c.get('completed', False))
-    incomplete = total - complete
+def get_page_window(total):
+    """Clamp the persisted page cursor and return (page, page_count, start, end)"""
+    page_size = st.session_state.get('page_size', DEFAULT_PAGE_SIZE)
+    page_count = max(1, -(-total // page_size))
+    page = min(st.session_state.get('case_page', 0), page_count - 1)
+    st.session_state.case_page = page
+    return page, page_count, page * page_size, min(total, (page + 1) * page_size)
+
+def render_page_controls(page, page_count, start, end, total, position):
+    """Render previous/next page buttons and the visible range"""
+    col1, col2, col3 = st.columns([1, 4, 1])
+    with col1:
+        if st.button("◀ Prev", key=f"page_prev_{position}", disabled=page == 0, use_container_width=True):
+            st.session_state.case_page = page - 1
+            st.rerun()
+    with col2:
+        st.markdown(f"Page **{page + 1}** of **{page_count}** &nbsp;&nbsp; *showing {start + 1}–{end} of {total} cases*")
+    with col3:
+        if st.button("Next ▶", key=f"page_next_{position}", disabled=page >= page_count - 1, use_container_width=True):
+            st.session_state.case_page = page + 1
+            st.rerun()
+
+def build_case_frame(cases):
+    """Typed DataFrame of the logbook: categoricals for the dropdown fields, real dates and flags"""
+    frame = pd.DataFrame.from_records(
+        cases, columns=['id', 'date', 'completed', 'exported', 'linked_to', *ANALYTICS_CATEGORIES]
+    )
+    frame['date'] = pd.to_datetime(frame['date'], errors='coerce')
+    frame['month'] = frame['date'].dt.to_period('M')
+    frame['assessment_type'] = frame['assessment_type'].fillna('case')
+    for column, known in ANALYTICS_CATEGORIES.items():
+        values = frame[column].fillna('').astype(str).replace('', None)
+        extra = sorted(set(values.dropna().unique()) - set(known))
+        frame[column] = pd.Categorical(values, categories=[*known, *extra])
+    frame['completed'] = frame['completed'].fillna(False).astype(bool)
+    frame['exported'] = frame['exported'].fillna(False).astype(bool)
+    # Legacy cases have no linked_to at all, which leaves the column as float NaN
+    frame['epa_count'] = frame['linked_to'].map(lambda v: len(v) if isinstance(v, list) else 0).astype(int)
+    return frame.drop(columns='linked_to')
+
+def compute_analytics(frame):
+    """Monthly trend, per-field breakdowns and cross-tabs from one case frame"""
+    by_month = frame.groupby('month').agg(
+        cases=('id', 'size'),
+        completed=('completed', 'sum'),
+        with_epas=('epa_count', lambda counts: (counts > 0).sum())
+    )
+    by_month['completion_rate'] = by_month['completed'] / by_month['cases']
+    by_month.index = by_month.index.astype(str)
     
-    # Cases this week
-    today = datetime.now()
-    week_ago = datetime.now().timestamp() - (7 * 24 * 60 * 60)
-    this_week = sum(1 for c in st.session_state.cases 
-                    if datetime.strptime(c['date'], '%Y-%m-%d').timestamp() >= week_ago)
+    breakdowns = {}
+    for column in ANALYTICS_CATEGORIES:
+        counts = frame[column].value_counts(sort=False)
+        counts = counts[counts > 0].rename('cases')
+        counts.index = counts.index.astype(str)
+        breakdowns[column] = counts
     
+    specialty_by_urgency = pd.crosstab(frame['operation_type'], frame['urgency'],
+                                       rownames=['Specialty'], colnames=['Urgency'])
+    supervision_by_month = pd.crosstab(frame['month'].astype(str), frame['supervision_level'],
+                                       rownames=['Month'], colnames=['Supervision Level'])
+    # Unused categories would only add empty rows and columns
+    specialty_by_urgency = specialty_by_urgency.loc[specialty_by_urgency.sum(axis=1) > 0,
+                                                    specialty_by_urgency.sum(axis=0) > 0]
+    supervision_by_month = supervision_by_month.loc[:, supervision_by_month.sum(axis=0) > 0]
+    # Plain string labels display (and serialise) more reliably than categorical ones
+    for table in (specialty_by_urgency, supervision_by_month):
+        table.index = table.index.astype(str)
+        table.columns = table.columns.astype(str)
     return {
-        'total': total,
-        'complete': complete,
-        'incomplete': incomplete,
-        'this_week': this_week
+        'by_month': by_month,
+        'breakdowns': breakdowns,
+        'specialty_by_urgency': specialty_by_urgency,
+        'supervision_by_month': supervision_by_month
     }
 
+def get_analytics():
+    """Analytics tables for the current data, rebuilt only after the cases change"""
+    store = get_case_store()
+    analytics = store['analytics']
+    if analytics is None or analytics['version'] != store['version']:
+        # Snapshot under the lock so the frame matches the version it is tagged with
+        with get_storage_lock():
+            version = store['version']
+            frame = build_case_frame(store['cases'])
+        analytics = {'version': version, **compute_analytics(frame)}
+        store['analytics'] = analytics
+    return analytics
+
+def get_recent_months(count):
+    """The last count months as 'YYYY-MM', oldest first, ending with the current month"""
+    today = date.today()
+    months = []
+    for offset in range(count - 1, -1, -1):
+        year, month = divmod(today.year * 12 + today.month - 1 - offset, 12)
+        months.append(f"{year:04d}-{month + 1:02d}")
+    return months
+
+def render_coverage_heatmap(counters, columns, labels):
+    """HTML table of EPA rows by counter columns, shaded by count with empty cells flagged"""
+    epas = EPA_OPTIONS + sorted(set(counters) - set(EPA_OPTIONS))
+    peak = max((counters.get(epa, {}).get(column, 0) for epa in epas for column in columns), default=0) or 1
+    
+    rows = ['<tr><th>EPA</th>' + ''.join(f'<th>{label}</th>' for label in labels) + '</tr>']
+    for epa in epas:
+        counts = counters.get(epa, {})
+        cells = []
+        for column in columns:
+            count = counts.get(column, 0)
+            if count:
+                shade = 0.15 + 0.85 * count / peak
+                text_color = 'white' if shade > 0.6 else '#1f2937'
+                cells.append(f'<td style="background: rgba(102, 126, 234, {shade:.2f}); color: {text_color}">{count}</td>')
+            else:
+                cells.append('<td class="coverage-gap">0</td>')
+        rows.append(f'<tr><th>{html.escape(epa)}</th>{"".join(cells)}</tr>')
+    return f'<table class="coverage-table">{"".join(rows)}</table>'
+
+def get_coverage_gaps():
+    """EPAs with no linked case in the last COVERAGE_GAP_MONTHS months"""
+    recent = get_recent_months(COVERAGE_GAP_MONTHS)
+    epa_by_month = st.session_state.case_stats['epa_by_month']
+    return [epa for epa in EPA_OPTIONS if not any(epa_by_month.get(epa, {}).get(month) for month in recent)]
+
+def get_stats():
+    """Calculate statistics from the incrementally maintained aggregate"""
+    stats = st.session_state.case_stats
+    
+    # Cases this week, summed over date buckets instead of parsing every case date;
+    # the aggregate is shared, so read it under the lock other sessions change it under
+    cutoff = get_week_cutoff()
+    with get_storage_lock():
+        this_week = sum(count for day, count in stats['by_date'].items() if day >= cutoff)
+        
+        return {
+            'total': stats['total'],
+            'complete': stats['complete'],
+            'incomplete': stats['total'] - stats['complete'],
+            'exported': stats['exported'],
+            'this_week': this_week
+        }
+
 # Main UI
 st.title("🏥 Anaesthetic Case Logger")
 st.markdown("*Quick capture for portfolio documentation*")
 
+pending_saves = get_pending_saves()
+if pending_saves:
+    st.caption(f"💾 Saving {pending_saves} change(s)…")
+
 # Info about AI helper
 with st.expander("ℹ️ About the AI Helper"):
     st.markdown("""
@@ -1251,14 +2740,17 @@ col1, col2, col3, col4, col5 = st.columns([2, 2, 2, 2, 2])
 with col1:
     if st.button("📋 All Cases", use_container_width=True):
         st.session_state.filter = 'all'
+        st.session_state.case_page = 0
 
 with col2:
     if st.button(f"⏳ To Do ({stats['incomplete']})", use_container_width=True):
         st.session_state.filter = 'incomplete'
+        st.session_state.case_page = 0
 
 with col3:
     if st.button(f"✅ Done ({stats['complete']})", use_container_width=True):
         st.session_state.filter = 'complete'
+        st.session_state.case_page = 0
 
 with col4:
     if st.button("➕ Add Case", use_container_width=True, type="primary"):
@@ -1266,24 +2758,33 @@ with col4:
         st.session_state.editing_id = None
 
 with col5:
-    # Export button
+    # Export button - the payload is only built when asked for and reused until
+    # the filter or the data changes
     filter_type = st.session_state.get('filter', 'all')
-    if filter_type == 'incomplete':
-        cases_to_export = [c for c in st.session_state.cases if not c.get('completed', False)]
-    elif filter_type == 'complete':
-        cases_to_export = [c for c in st.session_state.cases if c.get('completed', False)]
-    else:
-        cases_to_export = st.session_state.cases
-    
-    if cases_to_export:
-        export_text = export_cases(cases_to_export)
-        st.download_button(
-            label="📥 Export",
-            data=export_text,
-            file_name=f"cases_export_{datetime.now().strftime('%Y%m%d')}.txt",
-            mime="text/plain",
-            use_container_width=True
+    export_count = {'incomplete': stats['incomplete'], 'complete': stats['complete']}.get(filter_type, stats['total'])
+    
+    if export_count:
+        export_format = st.selectbox(
+            "Export format",
+            list(EXPORT_FORMATS),
+            format_func=lambda key: EXPORT_FORMATS[key][0],
+            key="export_format",
+            label_visibility="collapsed"
         )
+        _, extension, mime = EXPORT_FORMATS[export_format]
+        export_key = (filter_type, export_format, st.session_state.data_version)
+        prepared_export = st.session_state.get('prepared_export')
+        if prepared_export and prepared_export['key'] == export_key:
+            st.download_button(
+                label="📥 Download",
+                data=prepared_export['data'],
+                file_name=f"cases_export_{datetime.now().strftime('%Y%m%d')}.{extension}",
+                mime=mime,
+                use_container_width=True
+            )
+        elif st.button("📥 Export", use_container_width=True, help="Prepare an export of the cases in this view"):
+            st.session_state.prepared_export = {'key': export_key, 'data': write_export(query_cases(filter_type), export_format)}
+            st.rerun()
 
 st.markdown("---")
 
@@ -1294,7 +2795,7 @@ if st.session_state.show_form:
         
         # Load existing case data if editing
         if st.session_state.editing_id is not None:
-            existing_case = next((c for c in st.session_state.cases if c['id'] == st.session_state.editing_id), {})
+            existing_case = get_case(st.session_state.editing_id) or {}
         else:
             existing_case = {}
         
@@ -1328,6 +2829,11 @@ if st.session_state.show_form:
             
             st.text_input("What case are you documenting?", key="ai_case_summary", placeholder="e.g., 'Emergency laparotomy, ASA 3 patient, RSI done'")
             st.text_area("What are your key notes?", key="ai_notes_input", height=80, placeholder="Brief case details, challenges, what you did...")
+            regenerate = st.checkbox(
+                "🔄 Regenerate",
+                key="ai_regenerate",
+                help="Ask Claude again instead of reusing a saved answer to the same request"
+            )
             
             col1, col2 = st.columns(2)
             with col1:
@@ -1347,9 +2853,8 @@ Write a thoughtful, prose-based reflection (4-5 sentences) that demonstrates dee
 5. Write in first person, using flowing prose rather than bullet points
 
 The tone should be professional yet reflective, showing genuine clinical insight and thoughtful analysis rather than just describing what happened. Make it clear this is my own learning journey."""
-                            ai_text = call_claude_api(prompt, max_tokens=600)
                             st.success("✨ Generated Reflection:")
-                            st.code(ai_text, language=None)
+                            write_ai_stream(prompt, max_tokens=600, regenerate=regenerate)
                             st.caption("Copy this text ☝️ and paste into the Reflection field below")
                     else:
                         st.warning("Please fill in case details above first!")
@@ -1371,9 +2876,8 @@ Write insightful learning points as flowing prose (one paragraph, 5-6 sentences)
 5. End with actionable next steps for my development
 
 Write in first person with genuine insight. Avoid generic statements - be specific about what I learned and why it matters. Show clinical maturity and thoughtful self-reflection rather than just listing facts to memorize."""
-                            ai_text = call_claude_api(prompt, max_tokens=600)
                             st.success("✨ Generated Learning Points:")
-                            st.code(ai_text, language=None)
+                            write_ai_stream(prompt, max_tokens=600, regenerate=regenerate)
                             st.caption("Copy this text ☝️ and paste into the Learning Points field below")
                     else:
                         st.warning("Please fill in case details above first!")
@@ -1400,36 +2904,58 @@ Provide a thoughtful, insightful answer appropriate for a CT1 trainee that:
 - Encourages deeper thinking about the topic
 
 Write in a teaching style that's educational but not condescending. Help me understand the clinical principles and how to apply them."""
-                        ai_answer = call_claude_api(prompt, max_tokens=800)
                         st.success("🤖 Claude's Answer:")
-                        st.write(ai_answer)
+                        write_ai_stream(prompt, max_tokens=800, as_code=False, regenerate=regenerate)
                 else:
                     st.warning("Please enter a question!")
         
         # Specialty selector OUTSIDE form for dynamic updates
         st.markdown("---")
+        
+        # Typo-tolerant finder that fills in both the specialty and the procedure
+        finder_query = st.text_input(
+            "🔎 Quick find a procedure",
+            placeholder="e.g. lap chole, tonsilectomy, hip replacment",
+            help="Pick a match to skip choosing the specialty first",
+            key="procedure_finder"
+        )
+        if finder_query.strip():
+            matches = find_procedures(finder_query)
+            if matches:
+                cols = st.columns(2)
+                for idx, (match_procedure, match_specialty) in enumerate(matches):
+                    with cols[idx % 2]:
+                        if st.button(f"{match_procedure} · {match_specialty}", key=f"procedure_match_{idx}", use_container_width=True):
+                            st.session_state.specialty_selector = match_specialty
+                            st.session_state.picked_procedure = (match_procedure, match_specialty)
+                            st.rerun()
+            else:
+                st.caption("No close matches - choose a specialty below instead.")
+        
         st.markdown("**🏥 Select Surgical Specialty** (this will filter the procedure dropdown below)")
         
         # Get existing specialty if editing
         existing_specialty = ''
         if st.session_state.editing_id:
-            existing_case = next((c for c in st.session_state.cases if c['id'] == st.session_state.editing_id), {})
+            existing_case = get_case(st.session_state.editing_id) or {}
             existing_specialty = existing_case.get('operation_type', '')
         
+        # A pick from the finder has already set the selector's value
+        picked_procedure = st.session_state.get('picked_procedure')
         specialty = st.selectbox(
             "Surgical Specialty",
-            [''] + SPECIALTIES + ['Anaesthetic Procedure', 'Other'],
-            index=SPECIALTIES.index(existing_specialty) + 1 if existing_specialty in SPECIALTIES else (
-                len(SPECIALTIES) + 1 if existing_specialty == 'Anaesthetic Procedure' else (
-                    len(SPECIALTIES) + 2 if existing_specialty == 'Other' else 0
-                )
-            ),
+            SPECIALTY_OPTIONS,
+            index=0 if picked_procedure else SPECIALTY_OPTION_INDEX.get(existing_specialty, 0),
             help="Select specialty to filter procedures below",
             key="specialty_selector"
         )
         
         # Store in session state for use in form
         st.session_state['selected_specialty'] = specialty
+        # Picking another specialty by hand drops the finder's choice
+        if picked_procedure and picked_procedure[1] != specialty:
+            picked_procedure = None
+            del st.session_state['picked_procedure']
         
         # Show which procedures will be available
         if specialty == 'Anaesthetic Procedure':
@@ -1456,8 +2982,8 @@ Write in a teaching style that's educational but not condescending. Help me unde
                 default_time = existing_case.get('time', '') if existing_case.get('time') else get_current_time_of_day()
                 time_of_day = st.selectbox(
                     "Time of Day",
-                    TIME_OF_DAY,
-                    index=TIME_OF_DAY.index(default_time) if default_time in TIME_OF_DAY else 0
+                    TIME_OF_DAY_OPTIONS,
+                    index=TIME_OF_DAY_OPTION_INDEX.get(default_time, 0)
                 )
             
             col1, col2 = st.columns(2)
@@ -1472,8 +2998,8 @@ Write in a teaching style that's educational but not condescending. Help me unde
             with col2:
                 asa_grade = st.selectbox(
                     "ASA Grade",
-                    [''] + ASA_GRADES,
-                    index=ASA_GRADES.index(existing_case.get('asa_grade', '')) + 1 if existing_case.get('asa_grade') in ASA_GRADES else 0
+                    ASA_OPTIONS,
+                    index=ASA_OPTION_INDEX.get(existing_case.get('asa_grade', ''), 0)
                 )
             
             col1, col2 = st.columns(2)
@@ -1481,8 +3007,8 @@ Write in a teaching style that's educational but not condescending. Help me unde
             with col1:
                 urgency = st.selectbox(
                     "Urgency",
-                    [''] + URGENCY_TYPES,
-                    index=URGENCY_TYPES.index(existing_case.get('urgency', '')) + 1 if existing_case.get('urgency') in URGENCY_TYPES else 0
+                    URGENCY_OPTIONS,
+                    index=URGENCY_OPTION_INDEX.get(existing_case.get('urgency', ''), 0)
                 )
             
             with col2:
@@ -1497,48 +3023,43 @@ Write in a teaching style that's educational but not condescending. Help me unde
             
             anaesthetic_type = st.selectbox(
                 "Anaesthetic Type",
-                [''] + ANAESTHETIC_TYPES,
-                index=ANAESTHETIC_TYPES.index(existing_case.get('anaesthetic_type', '')) + 1 if existing_case.get('anaesthetic_type') in ANAESTHETIC_TYPES else 0
+                ANAESTHETIC_OPTIONS,
+                index=ANAESTHETIC_OPTION_INDEX.get(existing_case.get('anaesthetic_type', ''), 0)
             )
             
             supervision_level = st.selectbox(
                 "Your Role / Supervision Level",
-                [''] + SUPERVISION_LEVELS,
-                index=SUPERVISION_LEVELS.index(existing_case.get('supervision_level', '')) + 1 if existing_case.get('supervision_level') in SUPERVISION_LEVELS else 0
+                SUPERVISION_OPTIONS,
+                index=SUPERVISION_OPTION_INDEX.get(existing_case.get('supervision_level', ''), 0)
             )
             
             case_type = st.selectbox(
                 "Case Type (optional)",
-                [''] + CASE_TYPES,
-                index=CASE_TYPES.index(existing_case.get('case_type', '')) + 1 if existing_case.get('case_type') in CASE_TYPES else 0
+                CASE_TYPE_OPTIONS,
+                index=CASE_TYPE_OPTION_INDEX.get(existing_case.get('case_type', ''), 0)
             )
             
             # Procedure dropdown - filtered by specialty
             st.markdown("**Procedure Performed**")
             
-            # Determine which procedures to show based on specialty
+            # Determine which procedures to show based on specialty (pre-sorted at import)
+            procedure_options = PROCEDURE_OPTIONS.get(specialty, PROCEDURE_OPTIONS[''])
+            procedure_index = PROCEDURE_OPTION_INDEX.get(specialty, PROCEDURE_OPTION_INDEX[''])
             if specialty == 'Anaesthetic Procedure':
-                available_procedures = COMMON_PROCEDURES
                 help_text = "Anaesthetic procedures (lines, blocks, etc.)"
-            elif specialty and specialty != 'Other' and specialty in PROCEDURES_BY_SPECIALTY:
-                available_procedures = PROCEDURES_BY_SPECIALTY[specialty]
-                help_text = f"Procedures filtered for {specialty}"
             elif specialty == 'Other':
-                available_procedures = ALL_SURGICAL_PROCEDURES
                 help_text = "All surgical procedures - please select specialty above to filter"
+            elif specialty in PROCEDURES_BY_SPECIALTY:
+                help_text = f"Procedures filtered for {specialty}"
             else:
                 # No specialty selected - show limited options
-                available_procedures = ['Please select a specialty first']
                 help_text = "Select a specialty above to see procedures"
             
-            # Sort and add to dropdown
-            if available_procedures != ['Please select a specialty first']:
-                available_procedures = sorted(available_procedures)
-            
+            default_procedure = picked_procedure[0] if picked_procedure else existing_case.get('procedure', '')
             procedure = st.selectbox(
                 "Select or type procedure (searchable)",
-                [''] + available_procedures + ['Other (type below)'],
-                index=available_procedures.index(existing_case.get('procedure', '')) + 1 if existing_case.get('procedure') in available_procedures else 0,
+                procedure_options,
+                index=procedure_index.get(default_procedure, 0),
                 label_visibility="collapsed",
                 help=help_text
             )
@@ -1547,7 +3068,7 @@ Write in a teaching style that's educational but not condescending. Help me unde
             if procedure == 'Other (type below)' or procedure == 'Please select a specialty first':
                 procedure = st.text_input(
                     "Enter procedure name",
-                    value=existing_case.get('procedure', '') if existing_case.get('procedure') not in available_procedures else '',
+                    value=existing_case.get('procedure', '') if existing_case.get('procedure') not in procedure_index else '',
                     placeholder="Type procedure name",
                     label_visibility="collapsed"
                 )
@@ -1572,27 +3093,28 @@ Write in a teaching style that's educational but not condescending. Help me unde
             # Assessment-specific fields
             if st.session_state.assessment_type == 'cbd':
                 st.markdown("**CBD Competency Areas**")
-                cbd_scores = existing_case.get('cbd_scores', {})
+                # Copy so unsaved form changes never touch the shared case
+                cbd_scores = dict(existing_case.get('cbd_scores', {}))
                 cols = st.columns(2)
                 for idx, area in enumerate(CBD_AREAS):
                     with cols[idx % 2]:
                         cbd_scores[area] = st.selectbox(
                             area,
-                            ['', 'Below expectations', 'Meets expectations', 'Above expectations', 'Excellent'],
-                            index=['', 'Below expectations', 'Meets expectations', 'Above expectations', 'Excellent'].index(cbd_scores.get(area, '')) if cbd_scores.get(area) else 0,
+                            CBD_SCORES,
+                            index=CBD_SCORE_INDEX.get(cbd_scores.get(area, ''), 0),
                             key=f"cbd_{area}"
                         )
             
             elif st.session_state.assessment_type == 'cex':
                 st.markdown("**CEX Competency Areas**")
-                cex_scores = existing_case.get('cex_scores', {})
+                cex_scores = dict(existing_case.get('cex_scores', {}))
                 cols = st.columns(2)
                 for idx, area in enumerate(CEX_AREAS):
                     with cols[idx % 2]:
                         cex_scores[area] = st.selectbox(
                             area,
-                            ['', '1 - Below expectations', '2 - Borderline', '3 - Meets expectations', '4 - Above expectations', '5 - Excellent'],
-                            index=['', '1 - Below expectations', '2 - Borderline', '3 - Meets expectations', '4 - Above expectations', '5 - Excellent'].index(cex_scores.get(area, '')) if cex_scores.get(area) else 0,
+                            CEX_SCORES,
+                            index=CEX_SCORE_INDEX.get(cex_scores.get(area, ''), 0),
                             key=f"cex_{area}"
                         )
             
@@ -1633,29 +3155,12 @@ Write in a teaching style that's educational but not condescending. Help me unde
             
             # Show EPA suggestions for assessments (not clinical cases)
             if st.session_state.assessment_type != 'case':
-                suggested_epas = []
                 assessment_type = st.session_state.assessment_type
                 
                 # Get suggestions based on procedure and notes
-                search_text = (procedure + ' ' + notes).lower()
-                
-                if assessment_type in EPA_SUGGESTIONS:
-                    suggestions_map = EPA_SUGGESTIONS[assessment_type]
-                    
-                    # Check for keywords
-                    for keyword, epas in suggestions_map.items():
-                        if keyword in search_text:
-                            suggested_epas.extend(epas)
-                    
-                    # If no matches, use default
-                    if not suggested_epas and 'default' in suggestions_map:
-                        suggested_epas = suggestions_map['default']
-                    
-                    # Remove duplicates
-                    suggested_epas = list(dict.fromkeys(suggested_epas))
-                    
-                    if suggested_epas:
-                        st.info(f"💡 **Suggested EPAs based on this {assessment_type.upper()}:** {', '.join(suggested_epas)}")
+                suggested_epas = suggest_epas(assessment_type, procedure + ' ' + notes)
+                if suggested_epas:
+                    st.info(f"💡 **Suggested EPAs based on this {assessment_type.upper()}:** {', '.join(suggested_epas)}")
             
             linked_to = []
             cols = st.columns(2)
@@ -1710,32 +3215,112 @@ Write in a teaching style that's educational but not condescending. Help me unde
             if cancel:
                 st.session_state.show_form = False
                 st.session_state.editing_id = None
+                st.session_state.pop('picked_procedure', None)
                 st.rerun()
 
 st.markdown("---")
 
 # Display cases
 filter_type = st.session_state.get('filter', 'all')
-filtered_cases = st.session_state.cases.copy()
 
-if filter_type == 'incomplete':
-    filtered_cases = [c for c in filtered_cases if not c.get('completed', False)]
-elif filter_type == 'complete':
-    filtered_cases = [c for c in filtered_cases if c.get('completed', False)]
+search_query = st.text_input("🔍 Search cases", placeholder="e.g. difficult airway, laparotomy, Dr Smith", key="case_search")
+if search_query != st.session_state.get('last_search_query', ''):
+    st.session_state.last_search_query = search_query
+    st.session_state.case_page = 0
 
-# Sort by date (most recent first)
-filtered_cases.sort(key=lambda x: x['date'], reverse=True)
+if search_query.strip():
+    # Ranked by relevance
+    filtered_cases = search_cases(search_query, filter_type)
+else:
+    # Sorted by date (most recent first)
+    filtered_cases = query_cases(filter_type, newest_first=True)
 
-if not filtered_cases:
+if not filtered_cases and search_query.strip():
+    st.info(f"🔍 No cases match \"{search_query}\".")
+elif not filtered_cases:
     st.info("📋 No cases to display. Start by adding your first case above!")
 else:
-    for case in filtered_cases:
+    # Bulk actions apply to the selection, which can span pages and filters
+    select_mode = st.checkbox("☑️ Select cases for bulk actions", key="select_mode")
+    selected = st.session_state.selected_cases
+    if select_mode:
+        # Forget cases deleted since they were selected
+        with get_storage_lock():
+            selected.intersection_update(st.session_state.case_index)
+        
+        if st.session_state.get('bulk_result'):
+            st.success(st.session_state.pop('bulk_result'))
+        
+        sel_col1, sel_col2, sel_col3 = st.columns([2, 1, 1])
+        with sel_col1:
+            st.markdown(f"**{len(selected)} case(s) selected**")
+        with sel_col2:
+            if st.button(f"Select all {len(filtered_cases)}", use_container_width=True, help="Select every case in this view, on every page"):
+                selected.update(c['id'] for c in filtered_cases)
+                st.rerun()
+        with sel_col3:
+            if st.button("Clear selection", use_container_width=True, disabled=not selected):
+                selected.clear()
+                st.session_state.confirm_bulk_delete = False
+                st.rerun()
+        
+        if selected:
+            bulk_col1, bulk_col2, bulk_col3, bulk_col4 = st.columns(4)
+            bulk_result = None
+            with bulk_col1:
+                if st.button("✅ Mark complete", use_container_width=True):
+                    bulk_result = f"Marked {set_case_field(selected, 'completed', True)} case(s) complete."
+            with bulk_col2:
+                if st.button("⏳ Mark to do", use_container_width=True):
+                    bulk_result = f"Marked {set_case_field(selected, 'completed', False)} case(s) to do."
+            with bulk_col3:
+                if st.button("📥 Mark exported", use_container_width=True):
+                    bulk_result = f"Marked {set_case_field(selected, 'exported', True)} case(s) exported."
+            with bulk_col4:
+                if st.session_state.get('confirm_bulk_delete'):
+                    if st.button(f"⚠️ Confirm delete {len(selected)}", use_container_width=True, type="primary"):
+                        bulk_result = f"Deleted {delete_cases(selected)} case(s)."
+                        selected.clear()
+                        st.session_state.confirm_bulk_delete = False
+                elif st.button("🗑️ Delete", use_container_width=True):
+                    st.session_state.confirm_bulk_delete = True
+                    st.rerun()
+            
+            epa_col1, epa_col2 = st.columns([3, 1])
+            with epa_col1:
+                bulk_epas = st.multiselect("EPAs to link", EPA_OPTIONS, key="bulk_epas", label_visibility="collapsed",
+                                           placeholder="Choose EPAs to link to the selected cases")
+            with epa_col2:
+                if st.button("🔗 Link EPAs", use_container_width=True, disabled=not bulk_epas):
+                    bulk_result = f"Linked EPAs to {link_epas(selected, bulk_epas)} case(s)."
+            
+            if bulk_result:
+                st.session_state.bulk_result = bulk_result
+                st.rerun()
+    
+    # Only the visible page of cards is rendered; the cursor lives in session state
+    st.selectbox(
+        "Cases per page",
+        PAGE_SIZE_OPTIONS,
+        index=PAGE_SIZE_OPTIONS.index(DEFAULT_PAGE_SIZE),
+        key="page_size"
+    )
+    page, page_count, start, end = get_page_window(len(filtered_cases))
+    render_page_controls(page, page_count, start, end, len(filtered_cases), "top")
+    st.markdown("---")
+    
+    for case in filtered_cases[start:end]:
         # IMPROVED: Ensure consistent display for ALL case types
         # Create a clean case card using native Streamlit components
         card_color = "#f0f0f0" if case.get('completed', False) else "#ffffff"
         border_color = "#10b981" if case.get('completed', False) else "#667eea"
         
         with st.container():
+            if select_mode:
+                # Checkbox state is rewritten from the selection so "select all" shows on every page
+                st.session_state[f"select_{case['id']}"] = case['id'] in selected
+                st.checkbox("Select", key=f"select_{case['id']}", on_change=sync_case_selection, args=(case['id'],))
+            
             # Date and badges
             status_badges = []
             if case.get('completed', False):
@@ -1786,6 +3371,12 @@ else:
             if supervision_line:
                 st.caption(" • ".join(supervision_line))
             
+            # LLP text is only formatted for cards the user has asked to export
+            if case['id'] in st.session_state.prepared_exports:
+                case_export = format_case_for_export(case)
+            else:
+                case_export = None
+            
             # IMPROVED: Action buttons in horizontal row beneath case details
             col_a, col_b, col_c, col_d, col_e, col_f = st.columns(6)
             with col_a:
@@ -1806,27 +3397,24 @@ else:
             with col_d:
                 if st.button("📋", key=f"duplicate_{case['id']}", help="Duplicate case", use_container_width=True):
                     # Create a duplicate with new ID and date
-                    duplicate = case.copy()
-                    duplicate['id'] = int(datetime.now().timestamp() * 1000)
-                    duplicate['date'] = date.today().isoformat()
-                    duplicate['completed'] = False
-                    duplicate['exported'] = False  # Reset exported status
-                    st.session_state.cases.append(duplicate)
-                    save_data()
+                    duplicate_case(case)
                     st.success("Case duplicated! Edit the new case to update details.")
                     st.rerun()
             with col_e:
                 # Export this case button
-                case_export = format_case_for_export(case)
-                st.download_button(
-                    label="📄",
-                    data=case_export,
-                    file_name=f"case_{case['date']}_{case.get('procedure', 'case').replace(' ', '_')}.txt",
-                    mime="text/plain",
-                    key=f"export_{case['id']}",
-                    help="Export this case",
-                    use_container_width=True
-                )
+                if case_export is not None:
+                    st.download_button(
+                        label="📄",
+                        data=case_export,
+                        file_name=case_file_name(case),
+                        mime="text/plain",
+                        key=f"export_{case['id']}",
+                        help="Export this case",
+                        use_container_width=True
+                    )
+                elif st.button("📄", key=f"prepare_export_{case['id']}", help="Prepare export for this case", use_container_width=True):
+                    st.session_state.prepared_exports.add(case['id'])
+                    st.rerun()
             with col_f:
                 if st.button("🗑️", key=f"delete_{case['id']}", help="Delete case", use_container_width=True):
                     delete_case(case['id'])
@@ -1837,14 +3425,17 @@ else:
                 # Quick copy section at top
                 st.markdown("**📋 Quick Copy for LLP (Lifelong Learning Platform):**")
                 st.info("💡 **Tip:** Copy this formatted text and paste directly into LLP's reflection/notes fields. Sections are clearly labeled for easy reference.")
-                case_export = format_case_for_export(case)
-                st.text_area(
-                    "Copy this text to your ePortfolio:",
-                    value=case_export,
-                    height=250,
-                    key=f"copy_area_{case['id']}"
-                )
-                st.caption("👆 Click in box → Ctrl+A (select all) → Ctrl+C (copy) → Paste into LLP")
+                if case_export is not None:
+                    st.text_area(
+                        "Copy this text to your ePortfolio:",
+                        value=case_export,
+                        height=250,
+                        key=f"copy_area_{case['id']}"
+                    )
+                    st.caption("👆 Click in box → Ctrl+A (select all) → Ctrl+C (copy) → Paste into LLP")
+                elif st.button("📋 Show LLP text", key=f"prepare_copy_{case['id']}"):
+                    st.session_state.prepared_exports.add(case['id'])
+                    st.rerun()
                 
                 st.markdown("---")
                 
@@ -1881,6 +3472,169 @@ else:
             
             # Add separator line between cases
             st.markdown("---")
+    
+    if page_count > 1:
+        render_page_controls(page, page_count, start, end, len(filtered_cases), "bottom")
+
+# EPA Coverage Section
+st.markdown("---")
+with st.expander("🎯 EPA Curriculum Coverage"):
+    # Read straight from the incrementally maintained counters, no case scan
+    case_stats = st.session_state.case_stats
+    with get_storage_lock():
+        coverage_gaps = get_coverage_gaps()
+        months = get_recent_months(COVERAGE_MONTHS)
+        month_table = render_coverage_heatmap(
+            case_stats['epa_by_month'], months,
+            [datetime.strptime(month, '%Y-%m').strftime('%b %y') for month in months]
+        )
+        type_table = render_coverage_heatmap(
+            case_stats['epa_by_type'], list(ASSESSMENT_TYPES),
+            [assessment_type.upper() for assessment_type in ASSESSMENT_TYPES]
+        )
+    
+    if coverage_gaps:
+        st.warning(f"⚠️ No cases linked in the last {COVERAGE_GAP_MONTHS} months: {', '.join(coverage_gaps)}")
+    else:
+        st.success(f"✅ Every EPA has linked cases in the last {COVERAGE_GAP_MONTHS} months.")
+    
+    st.markdown(f"**Cases linked per EPA, last {COVERAGE_MONTHS} months**")
+    st.markdown(month_table, unsafe_allow_html=True)
+    st.markdown("**Cases linked per EPA by assessment type**")
+    st.markdown(type_table, unsafe_allow_html=True)
+
+# Analytics Section
+st.markdown("---")
+with st.expander("📊 Logbook Analytics"):
+    if not st.session_state.cases:
+        st.info("Log some cases to see your analytics.")
+    elif st.checkbox("Show analytics", key="show_analytics"):
+        analytics = get_analytics()
+        
+        st.markdown("**Cases per month**")
+        st.bar_chart(analytics['by_month'][['cases', 'completed']])
+        st.markdown("**Completion rate by month**")
+        st.line_chart(analytics['by_month'][['completion_rate']])
+        
+        cols = st.columns(2)
+        for idx, (column, counts) in enumerate(analytics['breakdowns'].items()):
+            with cols[idx % 2]:
+                st.markdown(f"**{ANALYTICS_LABELS[column]}**")
+                if counts.empty:
+                    st.caption("Not recorded yet")
+                else:
+                    st.bar_chart(counts)
+        
+        st.markdown("**Specialty × urgency**")
+        st.dataframe(analytics['specialty_by_urgency'], use_container_width=True)
+        st.markdown("**Supervision level by month**")
+        st.dataframe(analytics['supervision_by_month'], use_container_width=True)
+
+# Batch AI Drafting Section
+st.markdown("---")
+with st.expander("🤖 Draft Reflections for All To-Do Cases"):
+    draft_targets = [c for c in st.session_state.cases
+                     if not c.get('completed', False) and (not c.get('reflection') or not c.get('learning'))]
+    st.caption("Fills in only the reflection and learning fields that are empty. Cases stay in To Do so you can review the drafts.")
+    if not draft_targets:
+        st.info("Every To-Do case already has a reflection and learning points.")
+    else:
+        st.write(f"**{len(draft_targets)}** To-Do case(s) are missing a reflection or learning points.")
+        batch_regenerate = st.checkbox("Ignore cached drafts", key="batch_draft_regenerate")
+        if st.button(f"✨ Draft {len(draft_targets)} Case(s)", type="primary"):
+            api_key = st.session_state.get('anthropic_api_key', '')
+            if not api_key:
+                st.error("Please enter your Anthropic API key in the AI Assistant section first!")
+            else:
+                progress_bar = st.progress(0.0, text="Drafting...")
+                drafts, failures = draft_cases(
+                    api_key, draft_targets,
+                    on_progress=lambda done, total: progress_bar.progress(done / total, text=f"Drafted {done}/{total} case(s)"),
+                    regenerate=batch_regenerate
+                )
+                
+                # Only fill fields that are still empty; the case may have been edited meanwhile
+                updates = {}
+                for case_id, fields in drafts.items():
+                    case = get_case(case_id)
+                    if case is not None:
+                        updates[case_id] = {k: v for k, v in fields.items() if not case.get(k)}
+                saved = update_cases(updates)
+                
+                if saved:
+                    st.success(f"✅ Drafted text for {saved} case(s). Review them in the To Do list.")
+                if failures:
+                    st.warning(f"⚠️ {len(failures)} case(s) could not be drafted. Run again to retry just those.")
+                    for case, error in failures:
+                        st.caption(f"{case['date']} - {case.get('procedure') or case.get('case_type', 'Case')}: {error}")
+
+# Bulk Import Section
+st.markdown("---")
+with st.expander("📥 Import Cases from CSV / JSON Lines"):
+    st.caption("Bring in an existing logbook. Columns are matched to case fields by name; "
+               "values must match the form's options (case doesn't matter). Cases already in your logbook are skipped.")
+    import_file = st.file_uploader("Logbook file", type=['csv', 'jsonl', 'ndjson'], key="import_file")
+    if import_file is not None:
+        import_format = 'csv' if import_file.name.lower().endswith('.csv') else 'jsonl'
+        try:
+            import_columns = read_import_columns(import_file, import_format)
+        except UnicodeDecodeError:
+            import_columns = None
+            st.error("The file is not UTF-8 text. Re-save it as UTF-8 CSV and try again.")
+        
+        if import_columns is not None and not import_columns:
+            st.warning("No columns found in this file.")
+        elif import_columns:
+            # Let the user correct the guessed column mapping
+            detected = detect_import_mapping(import_columns)
+            field_choices = ['(ignore)'] + list(IMPORT_FIELDS)
+            import_mapping = {}
+            cols = st.columns(3)
+            for idx, column in enumerate(import_columns):
+                with cols[idx % 3]:
+                    choice = st.selectbox(
+                        str(column),
+                        field_choices,
+                        index=field_choices.index(detected[column]) if detected[column] else 0,
+                        key=f"import_map_{idx}"
+                    )
+                    import_mapping[column] = None if choice == '(ignore)' else choice
+            
+            if 'date' not in import_mapping.values():
+                st.warning("Map a column to **date** to import - every case needs one.")
+            elif st.button("📥 Import Cases", type="primary"):
+                progress_bar = st.progress(0.0, text="Importing...")
+                try:
+                    added, duplicates, rejected = import_cases(
+                        import_file, import_format, import_mapping,
+                        on_progress=lambda fraction: progress_bar.progress(min(fraction, 1.0), text="Importing...")
+                    )
+                except UnicodeDecodeError:
+                    st.error("The file is not UTF-8 text. Re-save it as UTF-8 CSV and try again.")
+                else:
+                    progress_bar.progress(1.0, text="Import finished")
+                    st.success(f"✅ Imported {added} case(s); skipped {duplicates} already in your logbook.")
+                    if rejected:
+                        st.warning(f"⚠️ {len(rejected)} record(s) could not be imported:")
+                        for number, reason in rejected[:IMPORT_MAX_ERRORS_SHOWN]:
+                            st.caption(f"Record {number}: {reason}")
+                        if len(rejected) > IMPORT_MAX_ERRORS_SHOWN:
+                            st.caption(f"...and {len(rejected) - IMPORT_MAX_ERRORS_SHOWN} more")
+
+# EPA Back-fill Section
+st.markdown("---")
+with st.expander("🏷️ Suggest EPAs for Existing Assessments"):
+    unlinked = sum(1 for c in st.session_state.cases
+                   if c.get('assessment_type', 'case') in EPA_MATCHERS and not c.get('linked_to'))
+    st.caption("Links EPAs to assessments that have none, using the same keyword suggestions as the case form. Assessments with no matching keywords are left alone.")
+    if not unlinked:
+        st.info("Every CBD, CEX, DOPS and ACAT already has EPAs linked.")
+    elif st.button(f"🏷️ Suggest EPAs for {unlinked} Assessment(s)"):
+        linked = backfill_epas()
+        if linked:
+            st.success(f"✅ Linked EPAs to {linked} assessment(s).")
+        else:
+            st.info("No keywords matched in the remaining assessments - link their EPAs by hand.")
 
 # MCQ Generator Section
 st.markdown("---")
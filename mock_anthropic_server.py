@@ -0,0 +1,205 @@
+"""Local stand-in for the Anthropic Messages API, for trying the AI features offline.
+
+Supports plain and streaming ("stream": true) requests. Prompts that ask for
+MCQs get a canned question in the layout the MCQ bank parses.
+
+Run it, then point the app at it:
+
+    python mock_anthropic_server.py --port 8787
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8787 streamlit run case_logger.py
+
+Any non-empty API key is accepted except "bad-key", which gets a 401.
+
+Real-world conditions can be simulated: --latency/--jitter delay every reply,
+--rate-limit answers requests over the budget with 429 and a retry-after
+header, and --overload-rate fails a fraction of requests with 529.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_REPLY = (
+    "This is a canned reply from the local mock server. The case involved "
+    "careful pre-operative assessment and a clear anaesthetic plan."
+)
+
+# Returned instead when the prompt asks for MCQs, in the layout the app parses
+CANNED_MCQ = """QUESTION {number}:
+A 70-year-old man is given propofol for induction. Which receptor mediates its main hypnotic effect?
+A) NMDA receptor
+B) GABA-A receptor
+C) Alpha-2 adrenoceptor
+D) Mu opioid receptor
+E) Glycine receptor
+
+ANSWER: B
+EXPLANATION: Propofol potentiates GABA-A receptor chloride currents.
+
+---"""
+
+
+class MessagesHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+    # Buffer the response so headers and body leave in one write; separate small
+    # writes on a kept-alive connection stall on delayed ACKs
+    wbufsize = -1
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status, error_type, message, headers=None):
+        self.send_json(status, {"type": "error", "error": {"type": error_type, "message": message}}, headers)
+
+    def check_rate_limit(self):
+        """Take a token from the server's bucket; return seconds to wait if there is none"""
+        server = self.server
+        if not server.rate_limit:
+            return None
+        with server.bucket_lock:
+            now = time.monotonic()
+            server.tokens = min(server.bucket_size, server.tokens + (now - server.last_refill) * server.rate_limit)
+            server.last_refill = now
+            if server.tokens >= 1:
+                server.tokens -= 1
+                return None
+            return (1 - server.tokens) / server.rate_limit
+
+    def do_POST(self):
+        length = int(self.headers.get("content-length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self.send_error_json(400, "invalid_request_error", "Body is not valid JSON")
+            return
+
+        if self.path != "/v1/messages":
+            self.send_error_json(404, "not_found_error", f"Unknown path {self.path}")
+            return
+
+        api_key = self.headers.get("x-api-key", "")
+        if not api_key or api_key == "bad-key":
+            self.send_error_json(401, "authentication_error", "invalid x-api-key")
+            return
+
+        wait = self.check_rate_limit()
+        if wait is not None:
+            # The real API sends whole seconds
+            self.send_error_json(429, "rate_limit_error", "Number of requests has exceeded your rate limit",
+                                 {"retry-after": str(math.ceil(wait))})
+            return
+
+        if random.random() < self.server.overload_rate:
+            self.send_error_json(529, "overloaded_error", "Overloaded")
+            return
+
+        # Time to first byte
+        delay = self.server.latency + random.uniform(-self.server.jitter, self.server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if request.get("stream"):
+            self.send_stream(request)
+            return
+
+        reply = self.reply_text(request)
+        self.send_json(200, {
+            "id": "msg_mock",
+            "type": "message",
+            "role": "assistant",
+            "model": request.get("model", ""),
+            "content": [{"type": "text", "text": reply}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": 0, "output_tokens": len(reply.split())}
+        })
+
+    def reply_text(self, request):
+        prompt = "".join(m.get("content", "") for m in request.get("messages", []) if isinstance(m.get("content"), str))
+        match = re.search(r"starting from QUESTION (\d+)", prompt)
+        if "MCQ" in prompt:
+            return CANNED_MCQ.format(number=match.group(1) if match else 1)
+        return CANNED_REPLY
+
+    def send_event(self, event, data):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+        self.wfile.flush()
+
+    def send_stream(self, request):
+        # No content-length, so close the connection to mark the end of the stream
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        self.send_event("message_start", {"type": "message_start", "message": {
+            "id": "msg_mock", "type": "message", "role": "assistant", "model": request.get("model", ""),
+            "content": [], "stop_reason": None, "usage": {"input_tokens": 0, "output_tokens": 0}
+        }})
+        self.send_event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                "content_block": {"type": "text", "text": ""}})
+        words = CANNED_REPLY.split(" ")
+        for i, word in enumerate(words):
+            text = word if i == 0 else " " + word
+            self.send_event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                    "delta": {"type": "text_delta", "text": text}})
+            time.sleep(self.server.token_delay)
+        self.send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self.send_event("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                                          "usage": {"output_tokens": len(words)}})
+        self.send_event("message_stop", {"type": "message_stop"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, token_delay=0.02, rate_limit=0.0, overload_rate=0.0):
+        super().__init__(address, MessagesHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.overload_rate = overload_rate
+        # Token bucket holding up to one second's worth of requests, and never less
+        # than one so rates below 1 req/s still let a request through
+        self.rate_limit = rate_limit
+        self.bucket_size = max(1.0, rate_limit)
+        self.tokens = self.bucket_size
+        self.last_refill = time.monotonic()
+        self.bucket_lock = threading.Lock()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each reply starts")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- seconds added to --latency")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between streamed words")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second before 429s (0 = unlimited)")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="fraction of requests answered with 529")
+    args = parser.parse_args()
+
+    server = MockServer((args.host, args.port), latency=args.latency, jitter=args.jitter,
+                        token_delay=args.token_delay, rate_limit=args.rate_limit,
+                        overload_rate=args.overload_rate)
+    print(f"Mock Anthropic API listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()